@@ -40,7 +40,11 @@ vertices = (
 # indices = (
     # (0, 1, 2), (2, 1, 3))
 
-shader = gpu.shader.from_builtin('2D_UNIFORM_COLOR')
+#Builtin shader names lost their 2D_ and 3D_ prefixes in Blender 4.0
+if bpy.app.version >= (4, 0, 0):
+    shader = gpu.shader.from_builtin('UNIFORM_COLOR')
+else:
+    shader = gpu.shader.from_builtin('2D_UNIFORM_COLOR')
 #batch = batch_for_shader(shader, 'TRIS', {"pos": vertices}, indices=indices)
 
 batch = batch_for_shader(shader, 'TRI_FAN', {"pos": vertices})
@@ -122,7 +126,7 @@ class DrawContext2D:
         
     def fill_round_rectangle(self, x, y, width, height, radius = 0):
         if radius <= 0:
-            fill_rectangle(x, y, width, height)
+            self.fill_rectangle(x, y, width, height)
             return
     
         c2s = self.coords_to_screen_matrix()
@@ -203,7 +207,11 @@ class DrawContext2D:
         
         font_id = 0  # default font
         blf.color(font_id, self.font_color.x, self.font_color.y, self.font_color.z, self.font_color.w)
-        blf.size(font_id, self.font_size, self.font_dpi)
+        #Blender 4.0 dropped the dpi argument
+        if bpy.app.version >= (4, 0, 0):
+            blf.size(font_id, self.font_size * self.font_dpi / 72)
+        else:
+            blf.size(font_id, self.font_size, self.font_dpi)
 #        text_w, text_h = blf.dimensions(font_id, text)
         
         screenPos = c2s @ mXform @ Vector((x, y, 0, 1))
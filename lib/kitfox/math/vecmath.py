@@ -842,151 +842,40 @@ class Bounds:
         include_point(bounds.minBound)
         include_point(bounds.maxBound)
 
-    def __intersect_edge(self, p0, p1, ray_origin, ray_dir, ray_radius):
-        dir = p1 - p0
-        s = closest_point_to_line(p0, dir, ray_origin, ray_dir)
-        if math.isnan(s):
-            return False
-        # print("ray_origin " + str(ray_origin))
-        # print("ray_dir " + str(ray_dir))
-        # print("ray_radius " + str(ray_radius))
-            
-        # print("p0 " + str(p0))
-        # print("p1 " + str(p1))
-        # print("s " + str(s))
-        
-        s = max(min(s, 1), 0)
-        p = p0 + s * dir
-
-        # print("p " + str(p))
-        
-        offset_from_ray_origin = p - ray_origin
-        offset_parallel = offset_from_ray_origin.project(ray_dir)
-        offset_perp = offset_from_ray_origin - offset_parallel
-
-        # print("offset_perp " + str(offset_perp))
-        # print("offset_perp.length " + str(offset_perp.length))
-        
-        if offset_perp.dot(offset_perp) < ray_radius * ray_radius:
-            #We intersect with cube edge
-            return True
-        return False
-
-    def __intersect_face(self, p0, p1, p2, ray_origin, ray_dir):
-        # print ("__intersect_face ")
-        # print("p0 " + str(p0))
-        # print("p1 " + str(p1))
-        # print("p2 " + str(p2))
-        # print("ray_origin " + str(ray_origin))
-        # print("ray_dir " + str(ray_dir))
-    
-        v1 = p1 - p0
-        v2 = p2 - p0
-        normal = v1.cross(v2)
-        s = isect_line_plane(ray_origin, ray_dir, p0, normal)
-        if s == None:
-            #Parallel to face
-            return False
-        hit = ray_origin + s * ray_dir
-        v_hit = hit - p0
-
-#        print("hit " + str(hit))
-        
-        #Express v_hit as a linear combination of v1 and v2
-#        V = mathutils.Matrix(((v1.x, v2.x, normal.x), (v1.y, v2.y, normal.y), (v1.z, v2.z, normal.z)))
-        V = mathutils.Matrix((v1, v2, normal))
-        if V.determinant() == 0:
-            return False
-        
-        V.transpose()
-        V_i = V.inverted()
-        co = V_i @ v_hit
-        
-        if co.x >= 0 and co.x <= 1 and co.y >= 0 and co.y <= 1:
-            return True
-        
-        return False
-
+    #Tests if an infinite cylinder of radius ray_radius centered on the ray
+    # touches this box.  boundsXform places the box in the same space as the ray.
+    # The box is projected onto the plane perpendicular to the ray, where it
+    # becomes a convex polygon, and then separating axis tests are run against
+    # the circle the ray projects to.  The test is conservative near the corners
+    # of the projected box.
     def intersect_with_ray(self, ray_origin, ray_dir, ray_radius = 0, boundsXform = None):
-        p000 = mathutils.Vector((self.minBound.x, self.minBound.y, self.minBound.z))
-        p001 = mathutils.Vector((self.minBound.x, self.minBound.y, self.maxBound.z))
-        p010 = mathutils.Vector((self.minBound.x, self.maxBound.y, self.minBound.z))
-        p011 = mathutils.Vector((self.minBound.x, self.maxBound.y, self.maxBound.z))
-        p100 = mathutils.Vector((self.maxBound.x, self.minBound.y, self.minBound.z))
-        p101 = mathutils.Vector((self.maxBound.x, self.minBound.y, self.maxBound.z))
-        p110 = mathutils.Vector((self.maxBound.x, self.maxBound.y, self.minBound.z))
-        p111 = mathutils.Vector((self.maxBound.x, self.maxBound.y, self.maxBound.z))
-        
-        # print("p000 " + str(p000))
-        # print("p001 " + str(p001))
-        # print("p010 " + str(p010))
-        # print("p011 " + str(p011))
-        # print("p100 " + str(p100))
-        # print("p101 " + str(p101))
-        # print("p110 " + str(p110))
-        # print("p111 " + str(p111))
-        
+        center = (self.minBound + self.maxBound) / 2
+        half = (self.maxBound - self.minBound) / 2
+        axes = [vecX * half.x, vecY * half.y, vecZ * half.z]
+
         if boundsXform != None:
-            p000 = boundsXform @ p000
-            p001 = boundsXform @ p001
-            p010 = boundsXform @ p010
-            p011 = boundsXform @ p011
-            p100 = boundsXform @ p100
-            p101 = boundsXform @ p101
-            p110 = boundsXform @ p110
-            p111 = boundsXform @ p111
-
-        # print("after xform")
-        # print("p000 " + str(p000))
-        # print("p001 " + str(p001))
-        # print("p010 " + str(p010))
-        # print("p011 " + str(p011))
-        # print("p100 " + str(p100))
-        # print("p101 " + str(p101))
-        # print("p110 " + str(p110))
-        # print("p111 " + str(p111))
-        
-        #Check for edge intersections
-        if ray_radius > 0:
-            if self.__intersect_edge(p000, p100, ray_origin, ray_dir, ray_radius):
-                return True
-            if self.__intersect_edge(p000, p010, ray_origin, ray_dir, ray_radius):
-                return True
-            if self.__intersect_edge(p010, p110, ray_origin, ray_dir, ray_radius):
-                return True
-            if self.__intersect_edge(p100, p110, ray_origin, ray_dir, ray_radius):
-                return True
-            if self.__intersect_edge(p000, p001, ray_origin, ray_dir, ray_radius):
-                return True
-            if self.__intersect_edge(p100, p101, ray_origin, ray_dir, ray_radius):
-                return True
-            if self.__intersect_edge(p010, p011, ray_origin, ray_dir, ray_radius):
-                return True
-            if self.__intersect_edge(p110, p111, ray_origin, ray_dir, ray_radius):
-                return True
-            if self.__intersect_edge(p001, p101, ray_origin, ray_dir, ray_radius):
-                return True
-            if self.__intersect_edge(p001, p011, ray_origin, ray_dir, ray_radius):
-                return True
-            if self.__intersect_edge(p011, p111, ray_origin, ray_dir, ray_radius):
-                return True
-            if self.__intersect_edge(p101, p111, ray_origin, ray_dir, ray_radius):
-                return True
-        
-        if self.__intersect_face(p000, p010, p100, ray_origin, ray_dir):
-            return True
-        if self.__intersect_face(p000, p001, p100, ray_origin, ray_dir):
-            return True
-        if self.__intersect_face(p100, p101, p110, ray_origin, ray_dir):
-            return True
-        if self.__intersect_face(p010, p110, p011, ray_origin, ray_dir):
-            return True
-        if self.__intersect_face(p000, p001, p010, ray_origin, ray_dir):
-            return True
-        if self.__intersect_face(p001, p101, p011, ray_origin, ray_dir):
-            return True
-        
-        return False
+            center = boundsXform @ center
+            axes = [mul_vector(boundsXform, a) for a in axes]
+
+        dir = ray_dir.normalized()
+        u = dir.orthogonal().normalized()
+        v = dir.cross(u)
+
+        offset = center - ray_origin
+        pc = (offset.dot(u), offset.dot(v))
+        pe = [(a.dot(u), a.dot(v)) for a in axes]
+
+        #Separating axes are the edge normals and edge directions of the projected box
+        test_axes = [(-e[1], e[0]) for e in pe] + pe
+        for n in test_axes:
+            dist = abs(n[0] * pc[0] + n[1] * pc[1])
+            support = ray_radius * math.sqrt(n[0] * n[0] + n[1] * n[1])
+            for e in pe:
+                support += abs(n[0] * e[0] + n[1] * e[1])
+            if dist > support:
+                return False
+
+        return True
         
     def __str__(self):
         return "bounds [" + str(self.minBound) + " " + str(self.maxBound) + "]"
@@ -1010,6 +899,60 @@ def mesh_bounds_fast(obj, world = False):
     
     return bounds
     
+#Batch version of Bounds.intersect_with_ray that tests one ray against many boxes at once.
+#  bounds_min, bounds_max - (N, 3) arrays of box corners in local space
+#  xforms - (N, 4, 4) array of local to world matrices, or None if boxes are already in world space
+#  @returns boolean array of length N that is True where the cylinder touches the box
+def intersect_bounds_with_ray_batch(bounds_min, bounds_max, xforms, ray_origin, ray_dir, ray_radius = 0):
+    bounds_min = np.asarray(bounds_min, dtype = np.float64)
+    bounds_max = np.asarray(bounds_max, dtype = np.float64)
+    if bounds_min.shape[0] == 0:
+        return np.zeros(0, dtype = bool)
+
+    center = (bounds_min + bounds_max) * .5
+    half = (bounds_max - bounds_min) * .5
+    
+    if xforms is None:
+        #axes[n, :, j] is the j'th half extent vector of box n
+        axes = np.eye(3)[np.newaxis, :, :] * half[:, np.newaxis, :]
+    else:
+        xforms = np.asarray(xforms, dtype = np.float64)
+        rot = xforms[:, :3, :3]
+        center = np.einsum('nij,nj->ni', rot, center) + xforms[:, :3, 3]
+        axes = rot * half[:, np.newaxis, :]
+
+    dir = mathutils.Vector(ray_dir).normalized()
+    u = dir.orthogonal().normalized()
+    v = dir.cross(u)
+    basis = np.array((u, v))
+
+    #Project centers and extents onto plane perpendicular to ray
+    pc = (center - np.asarray(ray_origin)) @ basis.T
+    pe = np.einsum('kc,ncj->njk', basis, axes)
+
+    normals = np.concatenate((np.stack((-pe[..., 1], pe[..., 0]), axis = -1), pe), axis = 1)
+    dist = np.abs(np.einsum('nak,nk->na', normals, pc))
+    support = np.abs(np.einsum('nak,njk->naj', normals, pe)).sum(axis = 2)
+    support += ray_radius * np.sqrt((normals * normals).sum(axis = 2))
+    
+    return np.all(dist <= support, axis = 1)
+
+#Gathers the local bounds and world transforms of several objects into arrays
+#  for intersect_bounds_with_ray_batch()
+def mesh_bounds_fast_batch(objs):
+    count = len(objs)
+    bounds_min = np.empty((count, 3))
+    bounds_max = np.empty((count, 3))
+    xforms = np.empty((count, 4, 4))
+    
+    for i, obj in enumerate(objs):
+        corners = np.array(obj.bound_box)
+        bounds_min[i] = corners.min(axis = 0)
+        bounds_max[i] = corners.max(axis = 0)
+        xforms[i] = np.array(obj.matrix_world)
+        
+    return (bounds_min, bounds_max, xforms)
+    
 def mesh_bounds(obj, world = True, selected_faces_only = False):
 
     bounds = None
@@ -0,0 +1,112 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import bpy
+import bmesh
+import numpy as np
+
+#Returns the weight of each vertex in the named vertex group, or None if
+# obj has no such group.  Vertices outside the group have a weight of 0.
+# Vertex groups are not exposed to foreach_get, so the weights are read
+# through the bmesh deform layer, which costs one dictionary lookup per vertex
+# instead of walking the RNA group list of each vertex.
+def read_vertex_group_weights(obj, name):
+    group = obj.vertex_groups.get(name)
+    if group == None:
+        return None
+
+    group_index = group.index
+    bm = bmesh.new()
+    try:
+        bm.from_mesh(obj.data)
+        deform = bm.verts.layers.deform.active
+        if deform == None:
+            return np.zeros(len(bm.verts), dtype = np.float32)
+        return np.fromiter((v[deform].get(group_index, 0.0) for v in bm.verts), dtype = np.float32, count = len(bm.verts))
+    finally:
+        bm.free()
+
+#Returns the luminance of the named color attribute at each vertex, or None
+# if the mesh has no such attribute.  Face corner colors are averaged over
+# the corners of each vertex.
+def read_color_attribute_weights(obj, name):
+    mesh = obj.data
+    attr = mesh.attributes.get(name)
+    if attr == None or attr.data_type not in ('FLOAT_COLOR', 'BYTE_COLOR') or attr.domain not in ('POINT', 'CORNER'):
+        return None
+
+    color = np.empty(len(attr.data) * 4, dtype = np.float32)
+    attr.data.foreach_get("color", color)
+    color = color.reshape((-1, 4))
+    lum = color[:, 0] * .2126 + color[:, 1] * .7152 + color[:, 2] * .0722
+    if attr.domain == 'POINT':
+        return lum
+
+    loop_vert = np.empty(len(mesh.loops), dtype = np.int32)
+    mesh.loops.foreach_get("vertex_index", loop_vert)
+    total = np.bincount(loop_vert, weights = lum, minlength = len(mesh.vertices))
+    count = np.bincount(loop_vert, minlength = len(mesh.vertices))
+    return (total / np.maximum(count, 1)).astype(np.float32)
+
+#Dense per vertex mask weights for each object.  Reading a vertex group
+# visits every vertex in Python, so all the weights are read up front rather
+# than in the middle of a stroke.  Weights cannot be painted while the brush is
+# running, so they are kept until the mask settings change.  Objects without
+# the named vertex group or color attribute, and meshes in edit mode, are not
+# masked.
+class BrushMask:
+    def __init__(self):
+        self.settings = None
+        self.weights = {}
+
+    #Read the weights of any objs not read yet with the current mask settings.
+    # Called when the brush starts, when the selection changes and at the
+    # start of each stroke, so only a change of settings rereads anything.
+    def update(self, objs, mask_type, mask_name, mask_invert):
+        settings = (mask_type, mask_name, mask_invert)
+        if settings != self.settings:
+            self.settings = settings
+            self.weights = {}
+        if not self.is_active():
+            return
+
+        for obj in objs:
+            if obj.name not in self.weights and obj.mode == 'OBJECT':
+                self.weights[obj.name] = self.__read(obj)
+
+    def is_active(self):
+        return self.settings != None and self.settings[0] != 'NONE' and self.settings[1] != ""
+
+    def __read(self, obj):
+        mask_type, mask_name, mask_invert = self.settings
+        if mask_type == 'VERTEX_GROUP':
+            weights = read_vertex_group_weights(obj, mask_name)
+        else:
+            weights = read_color_attribute_weights(obj, mask_name)
+        if weights is not None:
+            weights = np.clip(weights, 0, 1)
+            if mask_invert:
+                weights = 1 - weights
+        return weights
+
+    #Returns the mask weight of every vertex of obj, or None if obj is not masked
+    def get(self, obj):
+        if not self.is_active() or obj.mode != 'OBJECT':
+            return None
+        return self.weights.get(obj.name)
+
+    #Bytes held for each object name
+    def memory_usage(self):
+        return {name: weights.nbytes for name, weights in self.weights.items() if weights is not None}
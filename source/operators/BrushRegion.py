@@ -0,0 +1,489 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import bpy
+import math
+import numpy as np
+from .SculptHistory import *
+
+#Integer point attribute written by Split Into Tiles holding the index of the
+# vertex each tile vertex was copied from.  Same name as
+# TerrainTileMeshOperator.tile_source_index_attr.
+weld_source_index_attr = "terrain_tile_src_index"
+
+#Offsets to a grid cell and its eight neighbours
+neighbour_cells = np.array([(x, y) for y in (-1, 0, 1) for x in (-1, 0, 1)], dtype = np.int64)
+
+#Average number of vertices in each cell of a VertexCache grid
+vertex_grid_verts_per_cell = 64
+
+#A grid is rebuilt once a vertex has drifted this many cells from where it
+# was when the grid was built
+vertex_grid_max_drift = 4
+
+#Primes used to hash grid cells
+cell_hash_primes = np.array((73856093, 19349663), dtype = np.int64)
+
+def hash_cells(cells):
+    return np.bitwise_xor.reduce(cells * cell_hash_primes, axis = 1)
+
+#Label the connected groups of count items joined by the pairs (a, b).  Each
+# item is labelled with the lowest index in its group.
+def connected_labels(count, a, b):
+    labels = np.arange(count)
+    while True:
+        low = np.minimum(labels[a], labels[b])
+        updated = labels.copy()
+        np.minimum.at(updated, a, low)
+        np.minimum.at(updated, b, low)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+#Falloff used by the brushes.  Same curve as the operator's stroke_falloff().
+def brush_falloff(frac, inner_radius):
+    atten = np.where(frac <= inner_radius, 1.0, (1 - frac) / max(1 - inner_radius, 1e-6))
+    atten = np.clip(atten, 0, 1)
+    return -atten * atten + 2 * atten
+
+#Returns two unit vectors perpendicular to up and to each other, chosen so
+# that an up of +Z gives +X and +Y
+def tangent_frame(up):
+    axis = np.zeros(3)
+    axis[np.argmin(np.abs(up))] = 1
+    tangent = axis - up * np.dot(axis, up)
+    tangent /= np.linalg.norm(tangent)
+    return tangent, np.cross(up, tangent)
+
+#Edge vertex pairs of each mesh, read once and reused by every dab.  An entry
+# is reread if the number of edges of its mesh changes.  The seam vertices of
+# each mesh are cached alongside.
+class EdgeCache:
+    def __init__(self):
+        self.edges = {}
+        self.seams = {}
+
+    def get(self, obj):
+        mesh = obj.data
+        entry = self.edges.get(obj.name)
+        if entry is None or len(entry) != len(mesh.edges):
+            entry = np.empty(len(mesh.edges) * 2, dtype = np.int32)
+            mesh.edges.foreach_get("vertices", entry)
+            entry = entry.reshape((-1, 2))
+            self.edges[obj.name] = entry
+            self.seams.pop(obj.name, None)
+        return entry
+
+    #Returns the indices of the vertices on the open edges of obj, which is
+    # where tiles meet, and their source index from Split Into Tiles or None
+    # if the mesh does not have one
+    def seam_vertices(self, obj):
+        edges = self.get(obj)
+        entry = self.seams.get(obj.name)
+        if entry is None:
+            mesh = obj.data
+            loop_edge = np.empty(len(mesh.loops), dtype = np.int32)
+            mesh.loops.foreach_get("edge_index", loop_edge)
+            faces_per_edge = np.bincount(loop_edge, minlength = len(edges))
+            verts = np.unique(edges[faces_per_edge == 1])
+
+            source = None
+            attr = mesh.attributes.get(weld_source_index_attr)
+            if attr != None and attr.domain == 'POINT' and attr.data_type == 'INT':
+                source = np.empty(len(mesh.vertices), dtype = np.int32)
+                attr.data.foreach_get("value", source)
+                source = source[verts]
+
+            entry = (verts, source)
+            self.seams[obj.name] = entry
+        return entry
+
+    def clear(self):
+        self.edges = {}
+        self.seams = {}
+
+    #Bytes held for each mesh name
+    def memory_usage(self):
+        usage = {name: edges.nbytes for name, edges in self.edges.items()}
+        for name, (verts, source) in self.seams.items():
+            usage[name] = usage.get(name, 0) + verts.nbytes + (source.nbytes if source is not None else 0)
+        return usage
+
+#Local coordinates of every vertex of a mesh along with a grid over their
+# world positions.  The vertices are sorted by cell so that the vertices of a
+# cell are one slice of order.  In flat mode the grid only covers world XY,
+# so moving vertices up and down never takes them out of their cells.
+class VertexGrid:
+    def __init__(self, obj, flat):
+        self.flat = flat
+        self.co = read_vertex_coords(obj)
+        self.xform = np.array(obj.matrix_world, dtype = np.float64)
+        world = self.co @ self.xform[:3, :3].T + self.xform[:3, 3]
+        if flat:
+            world = world * (1, 1, 0)
+
+        #Terrain tiles are close to flat, so cells are sized from the two
+        # largest extents of the mesh
+        count = max(len(world), 1)
+        extent = np.sort(np.ptp(world, axis = 0)) if len(world) > 0 else np.ones(3)
+        self.cell_size = max(math.sqrt(extent[1] * extent[2] * vertex_grid_verts_per_cell / count), 1e-6)
+
+        cells = np.floor(world / self.cell_size).astype(np.int64)
+        self.cell_min = cells.min(axis = 0) if len(cells) > 0 else np.zeros(3, dtype = np.int64)
+        self.dims = (cells.max(axis = 0) - self.cell_min + 1) if len(cells) > 0 else np.ones(3, dtype = np.int64)
+        keys = self.__keys(cells)
+        self.order = np.argsort(keys, kind = 'stable').astype(np.int32)
+        keys = keys[self.order]
+        unique, self.cell_start = np.unique(keys, return_index = True)
+        self.cell_end = np.append(self.cell_start[1:], len(keys))
+
+        local = np.stack(np.unravel_index(unique, self.dims), axis = 1)
+        self.cell_center = (local + self.cell_min + .5) * self.cell_size
+
+        #Distance each vertex has moved since the grid was built, not
+        # counting vertical moves in flat mode, and the largest of them
+        self.moved = np.zeros(len(self.co), dtype = np.float32)
+        self.drift = 0.0
+
+    def __keys(self, cells):
+        local = cells - self.cell_min
+        return (local[:, 0] * self.dims[1] + local[:, 1]) * self.dims[2] + local[:, 2]
+
+    #Returns the indices of the vertices in cells that may lie within radius
+    # of the line through location along axis
+    def query(self, location, axis, radius):
+        offset = self.cell_center - location
+        perp = offset - axis * (offset @ axis)[:, np.newaxis]
+        reach = radius + self.cell_size * math.sqrt(3) / 2 + self.drift
+        cells = np.nonzero(np.einsum('ij,ij->i', perp, perp) < reach * reach)[0]
+
+        start = self.cell_start[cells]
+        counts = self.cell_end[cells] - start
+        slots = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(start, counts)
+        return np.sort(self.order[slots])
+
+    def nbytes(self):
+        return self.co.nbytes + self.order.nbytes + self.moved.nbytes + self.cell_start.nbytes + self.cell_end.nbytes + self.cell_center.nbytes
+
+    def needs_rebuild(self, obj, flat):
+        return (flat != self.flat or len(self.co) != len(obj.data.vertices) or self.drift > self.cell_size * vertex_grid_max_drift
+            or not np.array_equal(self.xform, np.array(obj.matrix_world, dtype = np.float64)))
+
+    #Record that the vertices at indices now have local coordinates after
+    def update(self, indices, after):
+        step = (after - self.co[indices]) @ self.xform[:3, :3].T
+        if self.flat:
+            step[:, 2] = 0
+        self.moved[indices] += np.sqrt(np.einsum('ij,ij->i', step, step))
+        self.drift = max(self.drift, float(self.moved[indices].max()))
+        self.co[indices] = after
+
+#VertexGrids of the meshes the brush has touched, kept for the whole brush
+# session so that a dab only reads and transforms the vertices in the cells
+# under the brush.  The coordinates are updated in place as vertices are
+# moved.  Moves can take vertices out of their cells, so queries reach out by
+# the furthest any vertex has drifted and the grid is rebuilt once that
+# passes vertex_grid_max_drift cells.  A grid is also rebuilt if its mesh
+# changes size or transform and is dropped while its mesh is in edit mode.
+class VertexCache:
+    def __init__(self):
+        self.grids = {}
+
+    #Returns the grid of obj, or None if the mesh is not in object mode
+    def get(self, obj, world_shape_type):
+        if obj.mode != 'OBJECT':
+            self.grids.pop(obj.name, None)
+            return None
+
+        flat = world_shape_type == 'FLAT'
+        grid = self.grids.get(obj.name)
+        if grid == None or grid.needs_rebuild(obj, flat):
+            grid = VertexGrid(obj, flat)
+            self.grids[obj.name] = grid
+        return grid
+
+    #Record that the vertices of obj at indices now have local coordinates
+    # after
+    def update(self, obj, indices, after):
+        grid = self.grids.get(obj.name)
+        if grid == None:
+            return
+        if obj.mode != 'OBJECT':
+            del self.grids[obj.name]
+            return
+
+        indices = np.asarray(indices, dtype = np.int64)
+        if len(indices) > 0:
+            grid.update(indices, np.asarray(after, dtype = np.float32).reshape((-1, 3)))
+
+    #Record offsets added to the vertices of obj at indices
+    def discard(self, obj):
+        self.grids.pop(obj.name, None)
+
+    #Drop the grids of meshes not in objs
+    def retain(self, objs):
+        names = {obj.name for obj in objs}
+        self.grids = {name: grid for name, grid in self.grids.items() if name in names}
+
+    def clear(self):
+        self.grids = {}
+
+    #Bytes held for each mesh name
+    def memory_usage(self):
+        return {name: grid.nbytes() for name, grid in self.grids.items()}
+
+#The vertices of the tiles under one dab gathered into flat arrays so that
+# brushes can work on all of them at once.  Heights are measured along the
+# up direction of each vertex, which is +Z in flat mode and away from the
+# terrain origin in sphere mode.  Only meshes in object mode are gathered.
+# Brushes that cover something other than a disk pass select, which is given
+# the world coordinates of all vertices of a mesh and returns the indices of
+# those to gather.  With a VertexCache, disk brushes only look at the
+# vertices in the grid cells under the brush and no mesh is read.
+class BrushRegion:
+    def __init__(self, objs, location, brush_up, brush_radius, inner_radius, terrain_origin, world_shape_type, select = None, vertex_cache = None):
+        self.location = np.array(location, dtype = np.float64)
+        self.up_axis = np.array(brush_up, dtype = np.float64)
+        self.up_axis /= np.linalg.norm(self.up_axis)
+        self.tangent, self.binormal = tangent_frame(self.up_axis)
+        self.radius = brush_radius
+        self.terrain_origin = np.array(terrain_origin, dtype = np.float64)
+        self.world_shape_type = world_shape_type
+        self.vertex_cache = vertex_cache
+
+        self.parts = []
+        self.verts_scanned = 0
+        world_parts = []
+        start = 0
+        for obj in objs:
+            if obj.type != 'MESH' or obj.mode != 'OBJECT':
+                continue
+
+            grid = vertex_cache.get(obj, world_shape_type) if vertex_cache != None else None
+            co = grid.co if grid != None else read_vertex_coords(obj)
+            xform = np.array(obj.matrix_world, dtype = np.float64)
+
+            #In sphere mode each vertex is measured along its own up, which
+            # can point away from the brush axis by up to the brush's angle
+            candidates = None
+            if grid != None and select == None:
+                reach = brush_radius if world_shape_type == 'FLAT' else 2 * brush_radius
+                candidates = grid.query(self.location, self.up_axis, reach)
+                world = co[candidates] @ xform[:3, :3].T + xform[:3, 3]
+            else:
+                world = co @ xform[:3, :3].T + xform[:3, 3]
+            self.verts_scanned += len(world)
+
+            if select != None:
+                indices = select(world)
+            else:
+                up = self.vertex_up(world)
+                offset = world - self.location
+                perp = offset - up * np.einsum('ij,ij->i', offset, up)[:, np.newaxis]
+                dist_sq = np.einsum('ij,ij->i', perp, perp)
+                indices = np.nonzero(dist_sq < brush_radius * brush_radius)[0]
+            if len(indices) == 0:
+                continue
+
+            world_parts.append(world[indices])
+            if candidates is not None:
+                indices = candidates[indices]
+            self.parts.append((obj, xform, co, indices, start, start + len(indices)))
+            start += len(indices)
+
+        self.count = start
+        self.world = np.concatenate(world_parts) if start > 0 else np.zeros((0, 3))
+        self.up = self.vertex_up(self.world)
+        self.height = self.vertex_height(self.world)
+
+        offset = self.world - self.location
+        self.uv = np.stack((offset @ self.tangent, offset @ self.binormal), axis = 1)
+        self.frac = np.sqrt(np.einsum('ij,ij->i', self.uv, self.uv)) / brush_radius
+        self.atten = brush_falloff(self.frac, inner_radius)
+
+    def __len__(self):
+        return self.count
+
+    def vertex_up(self, world):
+        if self.world_shape_type == 'FLAT':
+            return np.broadcast_to(np.array((0.0, 0.0, 1.0)), world.shape)
+        offset = world - self.terrain_origin
+        return offset / np.maximum(np.linalg.norm(offset, axis = 1), 1e-12)[:, np.newaxis]
+
+    def vertex_height(self, world):
+        if self.world_shape_type == 'FLAT':
+            return world[:, 2] - self.terrain_origin[2]
+        return np.linalg.norm(world - self.terrain_origin, axis = 1)
+
+    #Returns the index range of the vertices of each object in the flat arrays
+    def object_ranges(self):
+        return [(obj, start, end) for obj, xform, co, indices, start, end in self.parts]
+
+    #Returns the weight of each vertex in a BrushMask, or 1 where not masked
+    def mask_weights(self, mask):
+        weights = np.ones(self.count)
+        for obj, xform, co, indices, start, end in self.parts:
+            obj_weights = mask.get(obj)
+            if obj_weights is not None and len(obj_weights) == len(co):
+                weights[start:end] = obj_weights[indices]
+        return weights
+
+    #Find the mesh edges joining vertices of the region.  Seam vertices of
+    # different tiles less than snap_distance apart in the brush plane are
+    # welded into one so that the seams between tiles are treated as
+    # connected.  Vertices that both came from Split Into Tiles are only
+    # welded if they were copied from the same vertex.  Returns (weld id of
+    # each vertex, number of welded vertices, (n, 2) array of edges between
+    # weld ids).
+    def welded_edges(self, edge_cache, snap_distance):
+        edge_parts = []
+        seam_parts = []
+        for part, (obj, xform, co, indices, start, end) in enumerate(self.parts):
+            lookup = np.full(len(co), -1, dtype = np.int64)
+            lookup[indices] = np.arange(start, end)
+            edges = lookup[edge_cache.get(obj)]
+            edge_parts.append(edges[np.all(edges >= 0, axis = 1)])
+
+            if len(self.parts) > 1 and snap_distance > 0:
+                verts, source = edge_cache.seam_vertices(obj)
+                seams = lookup[verts]
+                inside = seams >= 0
+                source = source[inside] if source is not None else np.full(np.count_nonzero(inside), -1)
+                seam_parts.append((seams[inside], np.full(len(source), part), source))
+        edges = np.concatenate(edge_parts) if edge_parts else np.zeros((0, 2), dtype = np.int64)
+
+        ids = np.arange(self.count)
+        if seam_parts:
+            seams = np.concatenate([p[0] for p in seam_parts])
+            part = np.concatenate([p[1] for p in seam_parts])
+            source = np.concatenate([p[2] for p in seam_parts])
+            a, b = self.__seam_pairs(self.uv[seams], snap_distance)
+            keep = (part[a] != part[b]) & ((source[a] < 0) | (source[b] < 0) | (source[a] == source[b]))
+            ids[seams] = seams[connected_labels(len(seams), a[keep], b[keep])]
+
+        ids = np.unique(ids, return_inverse = True)[1].ravel()
+        count = ids.max() + 1 if len(ids) > 0 else 0
+        edges = ids[edges]
+        edges = edges[edges[:, 0] != edges[:, 1]]
+        return (ids, count, edges)
+
+    #Returns the index pairs (a, b) with a < b of the points less than
+    # distance apart.  Points are bucketed into cells distance wide and each
+    # is compared against the points of its own and neighbouring cells.
+    def __seam_pairs(self, points, distance):
+        cells = np.floor(points / distance).astype(np.int64)
+        keys = hash_cells(cells)
+        order = np.argsort(keys, kind = 'stable')
+        sorted_keys = keys[order]
+
+        a_parts = []
+        b_parts = []
+        for offset in neighbour_cells:
+            query = hash_cells(cells + offset)
+            first = np.searchsorted(sorted_keys, query, side = 'left')
+            counts = np.searchsorted(sorted_keys, query, side = 'right') - first
+            a = np.repeat(np.arange(len(points)), counts)
+            b = order[np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)]
+            a_parts.append(a[a < b])
+            b_parts.append(b[a < b])
+        a = np.concatenate(a_parts)
+        b = np.concatenate(b_parts)
+
+        offset = points[a] - points[b]
+        close = np.einsum('ij,ij->i', offset, offset) < distance * distance
+        return (a[close], b[close])
+
+    #Number of grid cells across the brush so that each cell holds about
+    # one vertex
+    def grid_resolution(self, max_resolution):
+        if self.count == 0:
+            return 1
+        spacing = math.sqrt(math.pi * self.radius * self.radius / self.count)
+        return int(np.clip(round(2 * self.radius / spacing), 4, max_resolution))
+
+    #Returns the grid cell coordinates of each vertex, with 0 at the edge of
+    # the first cell
+    def grid_coords(self, resolution):
+        return (self.uv + self.radius) * (resolution / (2 * self.radius))
+
+    #Average values into a square grid covering the brush in its tangent
+    # plane.  Cells without vertices take the average of their filled
+    # neighbours, growing inwards from the vertices.
+    def to_grid(self, values, resolution):
+        cells = np.clip(self.grid_coords(resolution).astype(np.int64), 0, resolution - 1)
+        flat = cells[:, 1] * resolution + cells[:, 0]
+        size = resolution * resolution
+        total = np.bincount(flat, weights = values, minlength = size).reshape((resolution, resolution))
+        count = np.bincount(flat, minlength = size).reshape((resolution, resolution)).astype(np.float64)
+
+        filled = count > 0
+        grid = np.where(filled, total / np.maximum(count, 1), 0)
+        while not np.all(filled):
+            padded = np.pad(np.where(filled, grid, 0), 1)
+            padded_filled = np.pad(filled, 1).astype(np.float64)
+            nb_sum = padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:]
+            nb_count = padded_filled[:-2, 1:-1] + padded_filled[2:, 1:-1] + padded_filled[1:-1, :-2] + padded_filled[1:-1, 2:]
+            grow = ~filled & (nb_count > 0)
+            if not np.any(grow):
+                grid[~filled] = np.mean(grid[filled]) if np.any(filled) else 0
+                break
+            grid[grow] = nb_sum[grow] / nb_count[grow]
+            filled |= grow
+        return grid
+
+    #Bilinearly sample a grid made by to_grid at each vertex
+    def sample_grid(self, grid):
+        resolution = len(grid)
+        f = np.clip(self.grid_coords(resolution) - .5, 0, resolution - 1)
+        i0 = np.minimum(f.astype(np.int64), resolution - 2) if resolution > 1 else np.zeros(f.shape, dtype = np.int64)
+        i1 = np.minimum(i0 + 1, resolution - 1)
+        t = f - i0
+        tx = t[:, 0]
+        ty = t[:, 1]
+        top = grid[i0[:, 1], i0[:, 0]] * (1 - tx) + grid[i0[:, 1], i1[:, 0]] * tx
+        bottom = grid[i1[:, 1], i0[:, 0]] * (1 - tx) + grid[i1[:, 1], i1[:, 0]] * tx
+        return top * (1 - ty) + bottom * ty
+
+    #Write new heights back to the meshes, moving each vertex along its up
+    # direction.  Returns a list of (obj, indices, before, after) in local
+    # coordinates for the vertices that moved.  The whole coordinate array of
+    # each changed mesh is written, since foreach_set cannot write part of
+    # one, but with a VertexCache it is not read back first.
+    def commit(self, heights):
+        world = self.world + self.up * (heights - self.height)[:, np.newaxis]
+
+        changes = []
+        for obj, xform, co, indices, start, end in self.parts:
+            local = (world[start:end] - xform[:3, 3]) @ np.linalg.inv(xform[:3, :3]).T
+            before = co[indices]
+            after = local.astype(np.float32)
+            moved = np.any(before != after, axis = 1)
+            if not np.any(moved):
+                continue
+
+            indices = indices[moved]
+            before = before[moved]
+            after = after[moved]
+            if self.vertex_cache != None:
+                self.vertex_cache.update(obj, indices, after)
+            co[indices] = after
+
+            mesh = obj.data
+            mesh.vertices.foreach_set("co", co.ravel())
+            mesh.update()
+            changes.append((obj, indices, before, after))
+
+        return changes
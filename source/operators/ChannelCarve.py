@@ -0,0 +1,107 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+#Points are added to the carve path once the cursor has moved this fraction
+# of the channel width from the last one
+carve_point_spacing = .25
+
+#Fraction of the channel width taken up by each bank of the BOX profile
+carve_box_bank = .25
+
+#Primes used to hash grid cells
+cell_hash_primes = np.array((73856093, 19349663, 83492791), dtype = np.int64)
+
+def hash_cells(cells):
+    return np.bitwise_xor.reduce(cells * cell_hash_primes, axis = 1)
+
+#Uniform grid over the segments of a polyline.  Each segment is listed under
+# every cell its bounds touch once grown by one cell, so the cell holding a
+# point lists every segment within cell_size of it.
+class SegmentIndex:
+    def __init__(self, points, cell_size):
+        self.start = np.asarray(points[:-1], dtype = np.float64)
+        self.end = np.asarray(points[1:], dtype = np.float64)
+        self.cell_size = cell_size
+
+        lo = np.floor(np.minimum(self.start, self.end) / cell_size).astype(np.int64) - 1
+        hi = np.floor(np.maximum(self.start, self.end) / cell_size).astype(np.int64) + 1
+        dims = hi - lo + 1
+        counts = np.prod(dims, axis = 1)
+
+        #One row for each (segment, cell) pair
+        segment = np.repeat(np.arange(len(self.start)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        d = dims[segment]
+        cells = lo[segment] + np.stack((local % d[:, 0], (local // d[:, 0]) % d[:, 1], local // (d[:, 0] * d[:, 1])), axis = 1)
+
+        keys = hash_cells(cells)
+        order = np.argsort(keys, kind = 'stable')
+        self.keys = keys[order]
+        self.segments = segment[order]
+
+    #Returns the distance from each point to the nearest segment, the index of
+    # that segment and how far along it the closest point lies in [0, 1].
+    # Points further than cell_size from every segment get an infinite
+    # distance.
+    def nearest(self, points):
+        points = np.asarray(points, dtype = np.float64)
+        keys = hash_cells(np.floor(points / self.cell_size).astype(np.int64))
+        first = np.searchsorted(self.keys, keys, side = 'left')
+        last = np.searchsorted(self.keys, keys, side = 'right')
+        counts = last - first
+
+        #One row for each (point, candidate segment) pair
+        point = np.repeat(np.arange(len(points)), counts)
+        candidate = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)
+        segment = self.segments[candidate]
+
+        a = self.start[segment]
+        span = self.end[segment] - a
+        length_sq = np.einsum('ij,ij->i', span, span)
+        t = np.clip(np.einsum('ij,ij->i', points[point] - a, span) / np.maximum(length_sq, 1e-12), 0, 1)
+        closest = a + span * t[:, np.newaxis]
+        dist = np.linalg.norm(points[point] - closest, axis = 1)
+
+        #Keep the closest candidate of each point
+        order = np.lexsort((dist, point))
+        point = point[order]
+        keep = np.ones(len(point), dtype = bool)
+        keep[1:] = point[1:] != point[:-1]
+        best = order[keep]
+
+        distance = np.full(len(points), np.inf)
+        nearest_segment = np.zeros(len(points), dtype = np.int64)
+        param = np.zeros(len(points))
+        distance[point[keep]] = dist[best]
+        nearest_segment[point[keep]] = segment[best]
+        param[point[keep]] = t[best]
+        return (distance, nearest_segment, param)
+
+#Height of the channel bed under each point of the path.  The bed sits depth
+# below the lowest ground reached so far, so it only ever runs downhill.
+def carve_bed_heights(path_heights, depth):
+    return np.minimum.accumulate(path_heights) - depth
+
+#Fraction of the full channel depth cut at each fraction of the way from the
+# center line to the bank
+def carve_profile(frac, profile):
+    frac = np.clip(frac, 0, 1)
+    if profile == 'V':
+        return 1 - frac
+    if profile == 'U':
+        return np.sqrt(1 - frac * frac)
+    return np.clip((1 - frac) / carve_box_bank, 0, 1)
@@ -22,11 +22,14 @@ import gpu
 import mathutils
 import math
 import bmesh
+import time
 from ..kitfox.math.vecmath import *
 from ..kitfox.blenderUtil import *
+from .PerfMetrics import *
 
         
 def pick_object(ray_origin, ray_direction):
+    time_start = time.perf_counter()
     hit_object = False
     best_loc = None
     best_normal = None
@@ -35,8 +38,11 @@ def pick_object(ray_origin, ray_direction):
     best_matrix = None
     best_dist_sq = 0
     
-    for obj in bpy.context.selected_objects:
+    selected = bpy.context.selected_objects
+    culled = 0
+    for obj in selected:
         if obj.hide_select:
+            culled += 1
             continue
             
         l2w = obj.matrix_world
@@ -65,6 +71,7 @@ def pick_object(ray_origin, ray_direction):
             best_matrix = l2w
             best_dist_sq = dist_sq
         
+    perf_metrics.record('pick', time.perf_counter() - time_start, objects_total = len(selected), objects_culled = culled)
     return (hit_object, best_loc, best_normal, best_face_idx, best_obj, best_matrix)
 
 #--------------------------------------
@@ -0,0 +1,119 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import bpy
+import math
+import numpy as np
+from .SculptHistory import *
+
+#Cells are sized to hold about this many vertices each
+heightfield_verts_per_cell = 4
+
+#Largest number of cells along either axis
+heightfield_max_dim = 1024
+
+#Returns local coords transformed by a 4x4 world matrix
+def transform_points(xform, points):
+    points = np.asarray(points, dtype = np.float64).reshape((-1, 3))
+    return points @ xform[:3, :3].T + xform[:3, 3]
+
+#Grid over world XY holding the mean world Z of the vertices that fall in
+# each cell.  Sums and counts are kept per cell so that moved vertices can be
+# swapped out incrementally as the brush edits the mesh.
+class HeightField:
+    def __init__(self, objs):
+        self.objects = [obj for obj in objs if obj.type == 'MESH']
+        self.xforms = {obj.name: np.array(obj.matrix_world, dtype = np.float64) for obj in self.objects}
+        #Incremented whenever the heights change
+        self.version = 0
+        self.dirty = True
+
+    def mark_dirty(self):
+        self.dirty = True
+        self.version += 1
+
+    def __rebuild(self):
+        self.dirty = False
+        points = [transform_points(self.xforms[obj.name], read_vertex_coords(obj)) for obj in self.objects]
+        points = np.concatenate(points) if len(points) > 0 else np.zeros((0, 3))
+
+        if len(points) == 0:
+            self.dims = np.array([1, 1])
+            self.lo = np.zeros(2)
+            self.cell = np.ones(2)
+        else:
+            self.lo = points[:, :2].min(axis = 0)
+            extent = np.maximum(points[:, :2].max(axis = 0) - self.lo, 1e-6)
+            cell = math.sqrt(extent[0] * extent[1] * heightfield_verts_per_cell / len(points))
+            self.dims = np.clip(np.ceil(extent / cell), 1, heightfield_max_dim).astype(np.int64)
+            self.cell = extent / self.dims
+
+        size = self.dims[0] * self.dims[1]
+        cells = self.__cells(points)
+        self.sum = np.bincount(cells, weights = points[:, 2], minlength = size)
+        self.count = np.bincount(cells, minlength = size).astype(np.float64)
+
+    def __cells(self, points):
+        ij = np.floor((points[:, :2] - self.lo) / self.cell).astype(np.int64)
+        ij = np.clip(ij, 0, self.dims - 1)
+        return ij[:, 1] * self.dims[0] + ij[:, 0]
+
+    def memory_usage(self):
+        if self.dirty:
+            return {}
+        return {"(shared)": self.sum.nbytes + self.count.nbytes}
+
+    #Move vertices of obj from the before to the after local coords
+    def update(self, obj, before, after):
+        if self.dirty or len(before) == 0 or obj.name not in self.xforms:
+            return
+
+        xform = self.xforms[obj.name]
+        size = len(self.sum)
+        before = transform_points(xform, before)
+        after = transform_points(xform, after)
+        before_cells = self.__cells(before)
+        after_cells = self.__cells(after)
+        self.sum += np.bincount(after_cells, weights = after[:, 2], minlength = size) - np.bincount(before_cells, weights = before[:, 2], minlength = size)
+        self.count += np.bincount(after_cells, minlength = size) - np.bincount(before_cells, minlength = size)
+        self.version += 1
+
+    #Returns the bilinearly interpolated world height at each XY point, or nan
+    # where no cell around the point holds any vertices.  Points outside the
+    # grid take the height of the nearest edge.
+    def sample(self, xy):
+        if self.dirty:
+            self.__rebuild()
+
+        xy = np.asarray(xy, dtype = np.float64).reshape((-1, 2))
+        f = (xy - self.lo) / self.cell - .5
+        i0 = np.floor(f).astype(np.int64)
+        t = f - i0
+
+        total = np.zeros(len(xy))
+        weight = np.zeros(len(xy))
+        for dx, dy in ((0, 0), (1, 0), (0, 1), (1, 1)):
+            i = np.clip(i0[:, 0] + dx, 0, self.dims[0] - 1)
+            j = np.clip(i0[:, 1] + dy, 0, self.dims[1] - 1)
+            cells = j * self.dims[0] + i
+            w = (t[:, 0] if dx else 1 - t[:, 0]) * (t[:, 1] if dy else 1 - t[:, 1])
+            count = self.count[cells]
+            valid = count > .5
+            w = np.where(valid, w, 0)
+            total += w * np.where(valid, self.sum[cells] / np.maximum(count, 1), 0)
+            weight += w
+
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return np.where(weight > 1e-9, total / weight, np.nan)
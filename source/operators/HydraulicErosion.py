@@ -0,0 +1,90 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+#Largest number of grid cells across the brush the simulation runs on
+erosion_max_resolution = 128
+
+#Fraction of the drop to the lowest neighbour that water moves in one
+# iteration.  Larger values make water slosh back and forth between cells.
+erosion_flow_rate = .25
+
+#Largest fraction of the height difference to its neighbours that a cell may
+# be eroded or filled by in one iteration
+erosion_max_cut = .25
+
+#Slices that select each of the four neighbours of the interior of a grid
+# padded by one cell
+neighbour_slices = (
+    (slice(0, -2), slice(1, -1)),
+    (slice(2, None), slice(1, -1)),
+    (slice(1, -1), slice(0, -2)),
+    (slice(1, -1), slice(2, None)),
+)
+
+#Run grid based hydraulic erosion on the heights of a square grid.  Each
+# iteration rains onto every cell, moves water and the sediment it carries
+# towards lower neighbours, erodes or deposits towards the carrying capacity
+# of the flow and evaporates some water.  Cells on the border are held fixed
+# and water flowing into them leaves the grid.  Amounts are in units of
+# cell_size.  Returns the new heights.
+def erode_grid(height, cell_size, iterations, rain, solubility, deposition, capacity, evaporation):
+    h = np.array(height, dtype = np.float64)
+    water = np.zeros(h.shape)
+    sediment = np.zeros(h.shape)
+    border = np.ones(h.shape, dtype = bool)
+    border[1:-1, 1:-1] = False
+
+    for i in range(iterations):
+        water += rain * cell_size
+
+        #Water flows towards each lower neighbour in proportion to the drop
+        surface = np.pad(h + water, 1, mode = 'edge')
+        drops = np.stack([np.maximum(surface[1:-1, 1:-1] - surface[s], 0) for s in neighbour_slices])
+        total_drop = drops.sum(axis = 0)
+        moved = np.minimum(water, drops.max(axis = 0) * erosion_flow_rate)
+        share = np.where(total_drop > 0, moved / np.maximum(total_drop, 1e-12), 0)
+        outflow = drops * share
+
+        #Fast flow down steep drops carries the most sediment
+        slope = total_drop / cell_size
+        cap = capacity * moved * slope
+        excess = sediment - cap
+        change = np.where(excess > 0, deposition * excess, solubility * excess)
+        ground = np.pad(h, 1, mode = 'edge')
+        rises = np.stack([ground[s] - h for s in neighbour_slices])
+        change = np.clip(change, -erosion_max_cut * np.maximum(-rises.min(axis = 0), 0), erosion_max_cut * np.maximum(rises.max(axis = 0), 0))
+        change[border] = 0
+        h += change
+        sediment -= change
+
+        #Sediment leaves with the water in the same proportion
+        sediment_share = np.where(water > 0, sediment / np.maximum(water, 1e-12), 0)
+        water_in = np.zeros(np.add(h.shape, 2))
+        sediment_in = np.zeros(water_in.shape)
+        for flow, s in zip(outflow, neighbour_slices):
+            water_in[s] += flow
+            sediment_in[s] += flow * sediment_share
+        water += water_in[1:-1, 1:-1] - moved
+        sediment += sediment_in[1:-1, 1:-1] - moved * sediment_share
+
+        water[border] = 0
+        sediment[border] = 0
+        water *= 1 - evaporation
+
+    #Whatever is still suspended settles where it is
+    h[~border] += sediment[~border]
+    return h
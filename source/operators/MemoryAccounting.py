@@ -0,0 +1,113 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import bpy
+import os
+import time
+import tracemalloc
+
+#Fraction of the memory ceiling at which the brush starts warning
+memory_warning_fraction = .9
+
+#Largest number of objects listed under each subsystem in the panel
+memory_panel_rows = 4
+
+#Subsystem listing the traced Python allocations of each module
+traced_subsystem = "Python (traced)"
+
+#Seconds a tracemalloc breakdown is reused for, since taking a snapshot is slow
+traced_refresh_interval = 2
+
+#Seconds the panel reuses a report for.  The brush refreshes it on its own
+# schedule while it is running.
+report_refresh_interval = 1
+
+#Subsystem name -> callable returning {object name: bytes}.  Memory that is
+# not tied to one object is reported under "(shared)".
+memory_providers = {}
+
+traced_cache = None
+traced_cache_time = 0
+
+report_cache = None
+report_cache_time = 0
+
+def register_memory_provider(name, provider):
+    global report_cache
+    memory_providers[name] = provider
+    report_cache = None
+
+def unregister_memory_provider(name):
+    global report_cache
+    memory_providers.pop(name, None)
+    report_cache = None
+
+#Python allocations are traced per module of this add-on when Blender is
+# started with --debug.  Otherwise only the array sizes that the subsystems
+# report are counted.
+def start_memory_tracing():
+    if bpy.app.debug and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def stop_memory_tracing():
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+#Returns {module file name: bytes} of live Python allocations made by this add-on
+def traced_memory_usage():
+    global traced_cache, traced_cache_time
+    now = time.perf_counter()
+    if traced_cache != None and now - traced_cache_time < traced_refresh_interval:
+        return traced_cache
+
+    addon_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(True, addon_dir + os.sep + "*"),))
+    traced_cache = {os.path.basename(stat.traceback[0].filename): stat.size for stat in snapshot.statistics('filename')}
+    traced_cache_time = now
+    return traced_cache
+
+#Returns {subsystem: {object name: bytes}} for every registered provider
+def memory_report(include_traced = True):
+    report = {name: provider() for name, provider in memory_providers.items()}
+    if include_traced and tracemalloc.is_tracing():
+        report[traced_subsystem] = traced_memory_usage()
+    return report
+
+#Build a new report and keep it for cached_memory_report()
+def refresh_memory_report():
+    global report_cache, report_cache_time
+    report_cache = memory_report()
+    report_cache_time = time.perf_counter()
+    return report_cache
+
+#Returns the last report, rebuilt only when it is older than
+# report_refresh_interval, so that panel redraws do not query every provider
+def cached_memory_report():
+    if report_cache == None or time.perf_counter() - report_cache_time >= report_refresh_interval:
+        return refresh_memory_report()
+    return report_cache
+
+#Bytes held by all subsystems.  Traced Python memory overlaps the array sizes
+# and is left out.
+def memory_total(report):
+    return sum(sum(usage.values()) for name, usage in report.items() if name != traced_subsystem)
+
+def is_memory_near_ceiling(total, ceiling_bytes):
+    return ceiling_bytes > 0 and total >= ceiling_bytes * memory_warning_fraction
+
+def format_bytes(nbytes):
+    if nbytes >= 1024 * 1024:
+        return "%.1f MB" % (nbytes / (1024 * 1024))
+    return "%.1f KB" % (nbytes / 1024)
@@ -0,0 +1,92 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+#Number of lattice points along each side of a noise tile.  Noise repeats
+# after this many units.
+noise_tile_size = 256
+
+#Each octave is this many times the frequency of the one before
+noise_lacunarity = 2
+
+#Each octave is this fraction of the amplitude of the one before
+noise_gain = .5
+
+#Sharpness of the blend between the three planes of triplanar noise
+noise_triplanar_sharpness = 4
+
+#Random lattice values for each (seed, octave), built the first time they
+# are used.  Shared by every brush session.
+noise_tiles = {}
+
+def get_noise_tile(seed, octave):
+    key = (seed, octave)
+    tile = noise_tiles.get(key)
+    if tile is None:
+        rng = np.random.default_rng((seed, octave))
+        tile = rng.random((noise_tile_size, noise_tile_size), dtype = np.float32)
+        noise_tiles[key] = tile
+    return tile
+
+def clear_noise_tiles():
+    noise_tiles.clear()
+
+def noise_tiles_memory_usage():
+    return {"(shared)": sum(tile.nbytes for tile in noise_tiles.values())}
+
+#Smoothly interpolated lattice noise in [0, 1] at each (x, y) point
+def value_noise(tile, xy):
+    i0 = np.floor(xy).astype(np.int64)
+    t = xy - i0
+    t = t * t * (3 - 2 * t)
+    i0 &= noise_tile_size - 1
+    i1 = (i0 + 1) & (noise_tile_size - 1)
+    tx = t[:, 0]
+    ty = t[:, 1]
+    top = tile[i0[:, 1], i0[:, 0]] * (1 - tx) + tile[i0[:, 1], i1[:, 0]] * tx
+    bottom = tile[i1[:, 1], i0[:, 0]] * (1 - tx) + tile[i1[:, 1], i1[:, 0]] * tx
+    return top * (1 - ty) + bottom * ty
+
+#Fractal noise in [-1, 1] at each (x, y) point.  Ridged noise folds each
+# octave about its middle to make sharp crests.
+def fractal_noise(xy, seed, octaves, ridged):
+    total = np.zeros(len(xy))
+    amplitude = 1
+    amplitude_sum = 0
+    frequency = 1
+    for octave in range(octaves):
+        n = value_noise(get_noise_tile(seed, octave), xy * frequency + octave * 17.31)
+        if ridged:
+            n = 1 - np.abs(2 * n - 1)
+            n = n * n
+        total += amplitude * n
+        amplitude_sum += amplitude
+        amplitude *= noise_gain
+        frequency *= noise_lacunarity
+    return 2 * total / amplitude_sum - 1
+
+#Fractal noise at 3D points, blending noise projected along each axis by how
+# closely the normal faces that axis.  Used on sphere terrains, where no
+# single plane covers the whole surface without stretching.
+def triplanar_noise(points, normals, seed, octaves, ridged):
+    weights = np.abs(normals) ** noise_triplanar_sharpness
+    weights /= np.maximum(weights.sum(axis = 1), 1e-12)[:, np.newaxis]
+    total = np.zeros(len(points))
+    for axis, plane in enumerate(((1, 2), (0, 2), (0, 1))):
+        used = weights[:, axis] > 1e-3
+        if np.any(used):
+            total[used] += weights[used, axis] * fractal_noise(points[used][:, plane], seed, octaves, ridged)
+    return total
@@ -0,0 +1,108 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import csv
+import json
+import time
+import numpy as np
+
+#Phases timed on the brush hot path.  Records store the index into this list.
+perf_phases = ['dab', 'ramp', 'pick', 'query', 'commit', 'snapshot', 'carve']
+
+perf_record_dtype = np.dtype([
+    ('time', np.float64),
+    ('stroke', np.int32),
+    ('phase', np.uint8),
+    ('duration', np.float64),
+    ('verts_scanned', np.int32),
+    ('verts_modified', np.int32),
+    ('objects_total', np.int32),
+    ('objects_culled', np.int32),
+])
+
+#Number of records kept before the oldest are overwritten
+perf_ring_capacity = 65536
+
+#Fixed size buffer of timing records.  Recording writes one row in place so
+# it can stay on for every dab.
+class PerfRingBuffer:
+    def __init__(self, capacity = perf_ring_capacity):
+        self.data = np.zeros(capacity, dtype = perf_record_dtype)
+        self.pos = 0
+        self.count = 0
+        self.stroke = 0
+
+    def __len__(self):
+        return self.count
+
+    def begin_stroke(self):
+        self.stroke += 1
+
+    def record(self, phase, duration, verts_scanned = 0, verts_modified = 0, objects_total = 0, objects_culled = 0):
+        self.data[self.pos] = (time.perf_counter(), self.stroke, perf_phases.index(phase), duration,
+            verts_scanned, verts_modified, objects_total, objects_culled)
+        self.pos = (self.pos + 1) % len(self.data)
+        self.count = min(self.count + 1, len(self.data))
+
+    #Returns the records oldest first
+    def records(self):
+        if self.count < len(self.data):
+            return self.data[:self.count].copy()
+        return np.concatenate((self.data[self.pos:], self.data[:self.pos]))
+
+    def clear(self):
+        self.pos = 0
+        self.count = 0
+
+    def memory_usage(self):
+        return {"(shared)": self.data.nbytes}
+
+perf_metrics = PerfRingBuffer()
+
+def get_perf_metrics():
+    return perf_metrics
+
+#Times the enclosed block and records it under phase
+class PerfTimer:
+    def __init__(self, phase, **counts):
+        self.phase = phase
+        self.counts = counts
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        perf_metrics.record(self.phase, time.perf_counter() - self.start, **self.counts)
+        return False
+
+#Converts records to a list of dicts with the phase given by name
+def perf_records_to_dicts(records):
+    rows = []
+    for r in records:
+        row = {name: r[name].item() for name in perf_record_dtype.names}
+        row['phase'] = perf_phases[row['phase']]
+        rows.append(row)
+    return rows
+
+def write_perf_csv(path, records):
+    with open(path, "w", newline = "") as f:
+        writer = csv.DictWriter(f, fieldnames = perf_record_dtype.names)
+        writer.writeheader()
+        writer.writerows(perf_records_to_dicts(records))
+
+def write_perf_json(path, records):
+    with open(path, "w") as f:
+        json.dump({"records": perf_records_to_dicts(records)}, f, indent = 1)
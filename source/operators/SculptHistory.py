@@ -0,0 +1,542 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import bpy
+import numpy as np
+import zlib
+import threading
+import tempfile
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+
+#Coordinate deltas are quantized to steps of the largest delta in the entry
+# divided by 2 ^ history_quantize_bits
+history_quantize_bits = 23
+
+#Smallest step coordinate deltas are quantized to
+history_min_tolerance = 1e-7
+
+#Spilled entries are appended to a segment file until it grows past this size,
+# after which a new segment is started
+history_spill_segment_bytes = 64 * 1024 * 1024
+
+#Worker thread that compresses history entries off the main thread
+history_executor = None
+
+def get_history_executor():
+    global history_executor
+    if history_executor == None:
+        history_executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "terrain_history")
+    return history_executor
+
+def read_vertex_coords(obj):
+    mesh = obj.data
+    co = np.empty(len(mesh.vertices) * 3, dtype = np.float32)
+    mesh.vertices.foreach_get("co", co)
+    return co.reshape((-1, 3))
+
+#Add offsets to the vertices of obj at the given indices.  Vertices whose
+# offset is zero are skipped and the mesh is left alone if none remain.  The
+# whole coordinate array is read and written back in bulk, which is faster
+# than setting even a small fraction of the vertices one at a time.
+# Returns (obj, indices, offsets, after) for the vertices that moved, where
+# after holds their new coordinates, or None if the mesh was not written.
+def add_vertex_offsets(obj, indices, offsets):
+    moved = np.any(offsets != 0, axis = 1)
+    indices = indices[moved]
+    offsets = offsets[moved]
+    if len(indices) == 0:
+        return None
+
+    mesh = obj.data
+    co = read_vertex_coords(obj)
+    co[indices] += offsets
+    mesh.vertices.foreach_set("co", co.ravel())
+    mesh.update()
+    return (obj, indices, offsets, co[indices])
+
+#Write target coordinates to obj where they differ from the current ones.
+# Returns True if the mesh was written.
+def restore_vertex_coords(obj, target):
+    mesh = obj.data
+    co = read_vertex_coords(obj)
+    if co.shape != target.shape:
+        return False
+
+    if np.array_equal(co, target):
+        return False
+
+    mesh.vertices.foreach_set("co", target.ravel())
+    mesh.update()
+    return True
+
+#--------------------------------------
+
+#Vertices moved by the brush during the current stroke.  Each dab adds a chunk
+# of vertex indices along with their coordinates before and after the dab.
+class StrokeDirtySet:
+    def __init__(self):
+        self.chunks = {}
+
+    #Chunks are stored as compact arrays so that the memory held by a long
+    # stroke is what the budget counts.  Merging them is left to the history
+    # worker thread when the stroke is packed.
+    def add(self, obj, indices, before, after):
+        if len(indices) == 0:
+            return
+
+        indices = np.asarray(indices, dtype = np.int32)
+        before = np.asarray(before, dtype = np.float32).reshape((-1, 3))
+        after = np.asarray(after, dtype = np.float32).reshape((-1, 3))
+        self.chunks.setdefault(obj, []).append((indices, before, after))
+
+    def is_empty(self):
+        return len(self.chunks) == 0
+
+    #Returns the chunks gathered so far and starts a new stroke
+    def take(self):
+        chunks = self.chunks
+        self.chunks = {}
+        return chunks
+
+#Merge the chunks of one object into sorted unique indices with the coordinate
+# each vertex had before its first dab and after its last dab
+def pack_chunks(chunks):
+    indices = np.concatenate([c[0] for c in chunks])
+    before = np.concatenate([c[1] for c in chunks])
+    after = np.concatenate([c[2] for c in chunks])
+
+    unique, first = np.unique(indices, return_index = True)
+    last = len(indices) - 1 - np.unique(indices[::-1], return_index = True)[1]
+
+    return (unique, before[first], after[last])
+
+#--------------------------------------
+
+#Append only temporary file shared by spilled history entries.  Each entry
+# holds offsets into the segment, so the number of open files depends on the
+# disk used rather than the depth of the history.  The file is closed once
+# every entry written to it has been released.
+class SpillSegment:
+    def __init__(self):
+        self.file = tempfile.TemporaryFile(prefix = "terrain_history_")
+        self.size = 0
+        self.map = None
+        #Number of entries holding data in the segment
+        self.users = 0
+
+    def is_closed(self):
+        return self.file == None
+
+    def is_full(self):
+        return self.size >= history_spill_segment_bytes
+
+    #Returns the (offset, length) the data was written at
+    def append(self, data):
+        self.file.write(data)
+        span = (self.size, len(data))
+        self.size += len(data)
+        return span
+
+    #The map is remade whenever a read reaches past the end of it
+    def read(self, span):
+        offset, length = span
+        if self.map == None or len(self.map) < offset + length:
+            if self.map != None:
+                self.map.close()
+            self.file.flush()
+            self.map = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        return self.map[offset:offset + length]
+
+    def release(self):
+        self.users -= 1
+        if self.users > 0:
+            return
+        if self.map != None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+        self.file = None
+
+#--------------------------------------
+
+#Store the bytes of each element in separate planes so that zlib can find the
+# runs in the high order bytes
+def shuffle_bytes(arr):
+    arr = np.ascontiguousarray(arr)
+    return arr.view(np.uint8).reshape((-1, arr.itemsize)).T.tobytes()
+
+def unshuffle_bytes(data, dtype, shape):
+    itemsize = np.dtype(dtype).itemsize
+    planes = np.frombuffer(data, dtype = np.uint8).reshape((itemsize, -1))
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(shape)
+
+#Compressed form of the changes to one object.  Indices are stored as
+# differences between consecutive sorted indices and the coordinate deltas are
+# quantized to a tolerance picked for the entry.  Undo and redo add the same
+# quantized offsets to the current coordinates, so moving back and forth
+# through the history does not drift.
+class CompressedDelta:
+    def __init__(self, indices, before, after):
+        self.count = len(indices)
+
+        steps = np.diff(indices, prepend = 0).astype(np.uint32)
+        self.indices = zlib.compress(shuffle_bytes(steps), 1)
+
+        delta = after.astype(np.float64) - before
+        max_delta = np.abs(delta).max() if self.count > 0 else 0
+        self.tolerance = max(max_delta / (1 << history_quantize_bits), history_min_tolerance)
+        quantized = np.rint(delta / self.tolerance).astype(np.int32)
+        self.delta = zlib.compress(shuffle_bytes(quantized), 1)
+
+        #(offset, length) of the blobs once they are written to a spill segment
+        self.segment = None
+        self.indices_span = None
+        self.delta_span = None
+
+    def nbytes(self):
+        if self.segment != None:
+            return 0
+        return len(self.indices) + len(self.delta)
+
+    def disk_nbytes(self):
+        if self.segment == None:
+            return 0
+        return self.indices_span[1] + self.delta_span[1]
+
+    #Append the blobs to a SpillSegment and release them from memory
+    def spill_to(self, segment):
+        self.indices_span = segment.append(self.indices)
+        self.delta_span = segment.append(self.delta)
+        self.segment = segment
+        self.indices = None
+        self.delta = None
+
+    def __read(self, blob, span):
+        if blob != None:
+            return blob
+        return self.segment.read(span)
+
+    def decompress(self):
+        indices = zlib.decompress(self.__read(self.indices, self.indices_span))
+        delta = zlib.decompress(self.__read(self.delta, self.delta_span))
+        indices = np.cumsum(unshuffle_bytes(indices, np.uint32, (self.count,))).astype(np.int32)
+        quantized = unshuffle_bytes(delta, np.int32, (self.count, 3))
+        return (indices, (quantized * self.tolerance).astype(np.float32))
+
+#One stroke worth of changes.  Holds only the vertices the stroke moved.  The
+# entry is created from the raw dab chunks of the stroke, which are packed and
+# compressed on a worker thread so that releasing the mouse does not wait for
+# them.  The deltas are only decompressed again when the entry is undone or
+# redone.  Old entries can be spilled to a memory mapped SpillSegment.
+class HistoryEntry:
+    def __init__(self, chunks):
+        self.lock = threading.Lock()
+        self.chunks = chunks
+        self.compressed = None
+        self.future = None
+        self.spill_segment = None
+
+    def compress_async(self):
+        self.future = get_history_executor().submit(self.__compress)
+
+    def __compress(self):
+        compressed = {obj: CompressedDelta(*pack_chunks(obj_chunks)) for obj, obj_chunks in self.chunks.items()}
+        with self.lock:
+            self.compressed = compressed
+            self.chunks = None
+
+    def wait(self):
+        if self.future != None:
+            self.future.result()
+            self.future = None
+
+    def is_spilled(self):
+        return self.spill_segment != None
+
+    #Bytes held in memory
+    def nbytes(self):
+        return sum(self.object_nbytes().values())
+
+    #Bytes held in memory for each object
+    def object_nbytes(self):
+        with self.lock:
+            if self.compressed != None:
+                return {obj: c.nbytes() for obj, c in self.compressed.items()}
+            return {obj: sum(c[0].nbytes + c[1].nbytes + c[2].nbytes for c in obj_chunks) for obj, obj_chunks in self.chunks.items()}
+
+    #Bytes held in the spill segment
+    def disk_nbytes(self):
+        if self.compressed == None:
+            return 0
+        return sum(c.disk_nbytes() for c in self.compressed.values())
+
+    #Move the compressed deltas out of memory into segment.  An entry with
+    # nothing to write is still marked as spilled.
+    def spill(self, segment):
+        self.wait()
+        if self.is_spilled():
+            return
+
+        self.spill_segment = segment
+        segment.users += 1
+        for c in self.compressed.values():
+            c.spill_to(segment)
+
+    #Release the entry's share of the spill segment
+    def close(self):
+        self.wait()
+        if self.spill_segment != None:
+            self.spill_segment.release()
+            self.spill_segment = None
+
+    #Waits for any pending compression job before restoring.  Returns a list
+    # of (obj, indices, offsets, after) for the vertices that moved, as
+    # returned by add_vertex_offsets.
+    def apply_before(self):
+        self.wait()
+        changes = []
+        for obj, c in self.compressed.items():
+            indices, offsets = c.decompress()
+            change = add_vertex_offsets(obj, indices, -offsets)
+            if change != None:
+                changes.append(change)
+        return changes
+
+    def apply_after(self):
+        self.wait()
+        changes = []
+        for obj, c in self.compressed.items():
+            indices, offsets = c.decompress()
+            change = add_vertex_offsets(obj, indices, offsets)
+            if change != None:
+                changes.append(change)
+        return changes
+
+#Undo stack of sparse stroke deltas plus full coordinate bookmarks.  Memory use
+# is held under budget_bytes by spilling the oldest entries to disk and evicting
+# least recently used bookmarks.  Spilled entries are held under
+# disk_budget_bytes by evicting the oldest applied entries, then the newest
+# redo entries.  The most recent entry and protected bookmarks are always kept
+# in memory.  Protected bookmarks are not counted against budget_bytes, since
+# nothing can be freed to make room for them.  When the latest entry alone is
+# over budget, stats() reports it rather than the budget being exceeded
+# silently.
+class SculptHistory:
+    def __init__(self, budget_bytes = 256 * 1024 * 1024, disk_budget_bytes = 2048 * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self.disk_budget_bytes = disk_budget_bytes
+        self.entries = []
+        #Number of entries currently applied to the meshes
+        self.idx = 0
+        self.bookmarks = {}
+        self.protected_bookmarks = set()
+
+        #Segment that spilled entries are currently appended to
+        self.spill_segment = None
+
+        #Access stamps used to order evictions
+        self.clock = 0
+        self.last_used = {}
+
+    def __touch(self, item):
+        self.clock += 1
+        self.last_used[id(item)] = self.clock
+
+    def __forget(self, item):
+        self.last_used.pop(id(item), None)
+
+    def push(self, entry):
+        #Remove all history past current pointer
+        for old in self.entries[self.idx:]:
+            self.__forget(old)
+            old.close()
+        del self.entries[self.idx:]
+        
+        self.entries.append(entry)
+        self.idx = len(self.entries)
+        self.__touch(entry)
+        entry.compress_async()
+        self.enforce_budget()
+
+    #Returns the (obj, indices, offsets, after) applied, or None if there was
+    # nothing to undo
+    def undo(self):
+        if self.idx == 0:
+            return None
+        self.idx -= 1
+        entry = self.entries[self.idx]
+        changes = entry.apply_before()
+        self.__touch(entry)
+        return changes
+
+    def redo(self):
+        if self.idx == len(self.entries):
+            return None
+        entry = self.entries[self.idx]
+        changes = entry.apply_after()
+        self.__touch(entry)
+        self.idx += 1
+        return changes
+
+    #Store the full vertex coordinates of objs under key.  Protected bookmarks
+    # are never evicted.
+    def add_bookmark(self, key, objs, protected = False):
+        bookmark = {obj: read_vertex_coords(obj) for obj in objs}
+        if key in self.bookmarks:
+            self.__forget(self.bookmarks[key])
+        self.bookmarks[key] = bookmark
+        if protected:
+            self.protected_bookmarks.add(key)
+        self.__touch(bookmark)
+        self.enforce_budget()
+
+    #Add the current coordinates of any objs not yet stored under key
+    def extend_bookmark(self, key, objs):
+        if key not in self.bookmarks:
+            return
+        bookmark = self.bookmarks[key]
+        added = False
+        for obj in objs:
+            if obj not in bookmark:
+                bookmark[obj] = read_vertex_coords(obj)
+                added = True
+        if added:
+            self.enforce_budget()
+
+    #Returns the (obj, coords) of the meshes that were written
+    def restore_bookmark(self, key):
+        if key not in self.bookmarks:
+            return []
+        bookmark = self.bookmarks[key]
+        restored = [(obj, co) for obj, co in bookmark.items() if restore_vertex_coords(obj, co)]
+        self.__touch(bookmark)
+        return restored
+
+    def bookmark_nbytes(self, key):
+        return sum(co.nbytes for co in self.bookmarks[key].values())
+
+    def total_bytes(self):
+        return sum(e.nbytes() for e in self.entries) + sum(self.bookmark_nbytes(key) for key in self.bookmarks)
+
+    #Bytes held by protected bookmarks
+    def protected_bytes(self):
+        return sum(self.bookmark_nbytes(key) for key in self.protected_bookmarks if key in self.bookmarks)
+
+    def disk_bytes(self):
+        return sum(e.disk_nbytes() for e in self.entries)
+
+    def __open_spill_segment(self):
+        segment = self.spill_segment
+        if segment == None or segment.is_closed() or segment.is_full():
+            segment = SpillSegment()
+            self.spill_segment = segment
+        return segment
+
+    def enforce_budget(self):
+        total = self.total_bytes() - self.protected_bytes()
+        while total > self.budget_bytes:
+            candidates = []
+            #Oldest entry still in memory, other than the latest one
+            for entry in self.entries[:-1]:
+                if not entry.is_spilled():
+                    candidates.append((self.last_used.get(id(entry), 0), 'entry', entry))
+                    break
+            for key, bookmark in self.bookmarks.items():
+                if key not in self.protected_bookmarks:
+                    candidates.append((self.last_used.get(id(bookmark), 0), 'bookmark', key))
+            if len(candidates) == 0:
+                break
+
+            stamp, kind, item = min(candidates, key = lambda c: c[0])
+            if kind == 'entry':
+                size = item.nbytes()
+                item.spill(self.__open_spill_segment())
+                total -= size
+            else:
+                total -= self.bookmark_nbytes(item)
+                self.__forget(self.bookmarks.pop(item))
+
+        #Applied entries are dropped from the front, which only shortens how
+        # far back undo can go.  Once none are left the redo entries are
+        # dropped from the back, as a new stroke would.
+        disk = self.disk_bytes()
+        while disk > self.disk_budget_bytes:
+            if self.idx > 0:
+                entry = self.entries.pop(0)
+                self.idx -= 1
+            elif any(e.is_spilled() for e in self.entries):
+                entry = self.entries.pop()
+            else:
+                break
+            disk -= entry.disk_nbytes()
+            entry.close()
+            self.__forget(entry)
+
+    #Returns why the history is over budget_bytes or disk_budget_bytes, or
+    # None if it is within both
+    def over_budget_reason(self, total_bytes, disk_bytes):
+        reasons = []
+        if total_bytes - self.protected_bytes() > self.budget_bytes:
+            if len(self.entries) > 0 and not self.entries[-1].is_spilled() and self.entries[-1].nbytes() > self.budget_bytes:
+                reasons.append("latest stroke is larger than the memory budget")
+            else:
+                reasons.append("memory budget changed since the last stroke")
+        if disk_bytes > self.disk_budget_bytes:
+            reasons.append("disk budget changed since the last stroke")
+        if len(reasons) == 0:
+            return None
+        return ", ".join(reasons)
+
+    #Returns a dictionary describing how much memory and disk the history is using
+    def stats(self):
+        entry_bytes = [e.nbytes() for e in self.entries]
+        entry_disk_bytes = [e.disk_nbytes() for e in self.entries]
+        bookmark_bytes = {key: self.bookmark_nbytes(key) for key in self.bookmarks}
+        return {
+            "entry_count": len(self.entries),
+            "entry_bytes": entry_bytes,
+            "entry_disk_bytes": entry_disk_bytes,
+            "spilled_count": sum(1 for e in self.entries if e.is_spilled()),
+            "bookmark_count": len(self.bookmarks),
+            "bookmark_bytes": bookmark_bytes,
+            "total_bytes": sum(entry_bytes) + sum(bookmark_bytes.values()),
+            "protected_bytes": self.protected_bytes(),
+            "budget_bytes": self.budget_bytes,
+            "disk_bytes": sum(entry_disk_bytes),
+            "disk_budget_bytes": self.disk_budget_bytes,
+            "over_budget": self.over_budget_reason(sum(entry_bytes) + sum(bookmark_bytes.values()), sum(entry_disk_bytes)),
+        }
+
+    #Bytes held in memory for each object name
+    def memory_usage(self):
+        usage = {}
+        for entry in self.entries:
+            for obj, nbytes in entry.object_nbytes().items():
+                usage[obj.name] = usage.get(obj.name, 0) + nbytes
+        for bookmark in self.bookmarks.values():
+            for obj, co in bookmark.items():
+                usage[obj.name] = usage.get(obj.name, 0) + co.nbytes
+        return usage
+
+    def clear(self):
+        for entry in self.entries:
+            entry.close()
+        self.entries = []
+        self.idx = 0
+        self.spill_segment = None
+        self.bookmarks = {}
+        self.protected_bookmarks = set()
+        self.last_used = {}
@@ -0,0 +1,336 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import bpy
+import numpy as np
+import os
+import queue
+import struct
+import tempfile
+import threading
+import zlib
+from .SculptHistory import *
+
+#The journal is an append only file of records.  Each record is a header of
+# (type, name length, vertex count), the object name, a payload and a crc32
+# of everything before it.  A record cut short by a crash fails its crc and
+# ends the replay.
+journal_magic = b"KTSJ"
+journal_version = 1
+journal_header = struct.Struct("<4sI")
+journal_record_header = struct.Struct("<BHI")
+journal_crc = struct.Struct("<I")
+
+#Full coordinates of every vertex of an object before it was sculpted
+JOURNAL_BASE = 0
+#Offsets added to the coordinates of some vertices
+JOURNAL_OFFSET = 1
+#Full coordinates of every vertex of an object including sculpted changes.
+# Written when the log is compacted.
+JOURNAL_SNAPSHOT = 2
+
+#The log is compacted into one base record per object once it grows past
+# this size or twice the size of the base coordinates, whichever is larger
+journal_compact_min_bytes = 64 * 1024 * 1024
+
+#Journal for the current blend file.  Lives across brush sessions until the
+# file is saved, which starts it over, or another file is loaded.  A journal
+# on disk for this file while this is None was left by a crashed session.
+sculpt_journal = None
+
+def journal_path():
+    filepath = bpy.data.filepath
+    if filepath:
+        return filepath + ".terrain_journal"
+    return untitled_journal_path()
+
+#Files that have not been saved get a journal per Blender process, since
+# they cannot be opened again to recover it
+def untitled_journal_path():
+    return os.path.join(tempfile.gettempdir(), "untitled_%d.terrain_journal" % os.getpid())
+
+def get_sculpt_journal():
+    return sculpt_journal
+
+def open_sculpt_journal():
+    global sculpt_journal
+    if sculpt_journal == None:
+        sculpt_journal = SculptJournal(journal_path())
+    return sculpt_journal
+
+#Stop journaling.  Used when another file is loaded.  The file is left on
+# disk if it holds any changes since the last save so that they can still be
+# recovered, unless it belongs to a file that was never saved.
+def close_sculpt_journal():
+    global sculpt_journal
+    if sculpt_journal == None:
+        return
+    sculpt_journal.close()
+    path = sculpt_journal.path
+    if os.path.exists(path) and (path == untitled_journal_path() or not journal_has_records(path)):
+        os.remove(path)
+    sculpt_journal = None
+
+#Base coordinates the journal writer keeps for each object name
+def journal_memory_usage():
+    if sculpt_journal == None:
+        return {}
+    return {name: co.nbytes for name, co in list(sculpt_journal.coords.items())}
+
+#True if the journal at path holds any sculpted changes.  Base records alone
+# only repeat coordinates the meshes already had.  Only the record headers are
+# read.
+def journal_has_records(path):
+    if not os.path.exists(path):
+        return False
+
+    with open(path, "rb") as f:
+        header = f.read(journal_header.size)
+        if len(header) < journal_header.size or journal_header.unpack(header) != (journal_magic, journal_version):
+            return False
+
+        while True:
+            data = f.read(journal_record_header.size)
+            if len(data) < journal_record_header.size:
+                return False
+            type, name_len, count = journal_record_header.unpack(data)
+            if type != JOURNAL_BASE:
+                return True
+            f.seek(name_len + count * 12 + journal_crc.size, os.SEEK_CUR)
+
+#True if a journal left by an earlier session exists for the current file
+def has_unrecovered_journal():
+    return sculpt_journal == None and journal_has_records(journal_path())
+
+def encode_record(type, name, indices, values):
+    name_bytes = name.encode("utf-8")
+    parts = [journal_record_header.pack(type, len(name_bytes), len(values)), name_bytes]
+    if indices is not None:
+        parts.append(np.ascontiguousarray(indices, dtype = np.int32).tobytes())
+    parts.append(np.ascontiguousarray(values, dtype = np.float32).tobytes())
+    body = b"".join(parts)
+    return body + journal_crc.pack(zlib.crc32(body))
+
+#Returns a list of (type, name, indices, values) for each intact record
+def read_journal(path):
+    records = []
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if len(data) < journal_header.size:
+        return records
+    magic, version = journal_header.unpack_from(data, 0)
+    if magic != journal_magic or version != journal_version:
+        return records
+
+    pos = journal_header.size
+    while pos + journal_record_header.size <= len(data):
+        type, name_len, count = journal_record_header.unpack_from(data, pos)
+        index_bytes = count * 4 if type == JOURNAL_OFFSET else 0
+        end = pos + journal_record_header.size + name_len + index_bytes + count * 12
+        if end + journal_crc.size > len(data):
+            break
+        if zlib.crc32(data[pos:end]) != journal_crc.unpack_from(data, end)[0]:
+            break
+
+        p = pos + journal_record_header.size
+        name = data[p:p + name_len].decode("utf-8")
+        p += name_len
+        indices = None
+        if type == JOURNAL_OFFSET:
+            indices = np.frombuffer(data, dtype = np.int32, count = count, offset = p)
+            p += index_bytes
+        values = np.frombuffer(data, dtype = np.float32, count = count * 3, offset = p).reshape((-1, 3))
+        records.append((type, name, indices, values))
+        pos = end + journal_crc.size
+
+    return records
+
+#Replay the journal at path onto the objects of the current file.  Offsets for
+# objects without a base record are applied to their current coordinates,
+# which match the last save.  Objects whose vertex count does not match the
+# journal are left alone.  Returns the number of objects changed and the
+# number skipped.
+def recover_journal(path):
+    coords = {}
+    mismatched = set()
+    for type, name, indices, values in read_journal(path):
+        obj = bpy.data.objects.get(name)
+        if obj == None or obj.type != 'MESH':
+            continue
+
+        if type != JOURNAL_OFFSET:
+            if len(values) != len(obj.data.vertices):
+                mismatched.add(name)
+                coords.pop(name, None)
+            else:
+                mismatched.discard(name)
+                coords[name] = values.copy()
+            continue
+
+        if name in mismatched:
+            continue
+        if name not in coords:
+            coords[name] = read_vertex_coords(obj)
+        co = coords[name]
+        if len(indices) > 0 and indices.max() >= len(co):
+            mismatched.add(name)
+            del coords[name]
+            continue
+        co[indices] += values
+
+    count = 0
+    for name, co in coords.items():
+        if restore_vertex_coords(bpy.data.objects[name], co):
+            count += 1
+    return (count, len(mismatched))
+
+#Writes sculpt changes to a journal file from a background thread.  The main
+# thread only queues the data it already has; packing, encoding and writing
+# all happen on the writer thread.  The coordinates of an object are copied
+# the first time a change to it is recorded, so starting the brush costs
+# nothing.
+class SculptJournal:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.error = None
+        #Names of objects whose base has been queued, owned by the main thread
+        self.tracked = set()
+        #Current coordinates of each tracked object, owned by the writer thread
+        self.coords = {}
+        #Objects with changes written since the last save, owned by the writer thread
+        self.changed = set()
+
+        self.queue = queue.Queue()
+        self.queue.put(("compact", path))
+        self.thread = threading.Thread(target = self.__run, name = "terrain_journal", daemon = True)
+        self.thread.start()
+
+    #Called when the brush starts.  Each object gets a fresh base the first
+    # time it is changed in the session, since other tools may have edited it
+    # since the last one.
+    def begin_session(self):
+        self.tracked = set()
+
+    #Returns the current coordinates of obj if it has no base yet.  The
+    # writer thread turns them back into the coordinates before the change
+    # being recorded.
+    def __untracked_coords(self, obj):
+        if obj.name in self.tracked:
+            return None
+        self.tracked.add(obj.name)
+        return read_vertex_coords(obj)
+
+    #Record the chunks gathered by a StrokeDirtySet for one stroke
+    def record_stroke(self, chunks):
+        self.queue.put(("stroke", [(obj.name, self.__untracked_coords(obj), obj_chunks) for obj, obj_chunks in chunks.items()]))
+
+    #Record a list of (obj, indices, offsets, after) applied by undo or redo
+    def record_offsets(self, changes):
+        self.queue.put(("offsets", [(obj.name, self.__untracked_coords(obj), indices, offsets) for obj, indices, offsets, after in changes]))
+
+    #Record a list of (obj, coords) written over whole meshes
+    def record_coords(self, restored):
+        for obj, co in restored:
+            self.tracked.add(obj.name)
+            self.queue.put(("base", obj.name, co.copy()))
+
+    #Drop everything written so far.  Called once the blend file is saved,
+    # since the file then holds the current coordinates.
+    def reset(self, path):
+        self.queue.put(("reset", path))
+
+    def close(self):
+        self.queue.put(("close",))
+        self.thread.join()
+
+    def __run(self):
+        while True:
+            item = self.queue.get()
+            kind = item[0]
+            if kind == "close":
+                if self.file != None:
+                    self.file.close()
+                    self.file = None
+                return
+
+            if self.error != None:
+                continue
+
+            #Any failure stops the journal.  The queue is still drained so
+            # that it does not hold on to the coordinates sent to it.
+            try:
+                if kind == "compact":
+                    self.__compact(item[1], True)
+                elif kind == "reset":
+                    self.__compact(item[1], False)
+                elif kind == "base":
+                    self.__write_base(item[1], item[2])
+                elif kind == "stroke":
+                    for name, co, chunks in item[1]:
+                        indices, before, after = pack_chunks(chunks)
+                        if co is not None:
+                            co[indices] = before
+                            self.__write_base(name, co)
+                        self.__write_offsets(name, indices, after - before)
+                elif kind == "offsets":
+                    for name, co, indices, offsets in item[1]:
+                        if co is not None:
+                            co[indices] -= offsets
+                            self.__write_base(name, co)
+                        self.__write_offsets(name, indices, offsets)
+
+                self.file.flush()
+                if self.file.tell() > max(journal_compact_min_bytes, 2 * sum(co.nbytes for co in self.coords.values())):
+                    self.__compact(self.path, True)
+            except Exception as e:
+                self.error = "%s: %s" % (type(e).__name__, e)
+
+    def __write_base(self, name, co):
+        self.coords[name] = co
+        self.file.write(encode_record(JOURNAL_BASE, name, None, co))
+
+    def __write_offsets(self, name, indices, offsets):
+        co = self.coords.get(name)
+        if co is None or len(indices) == 0 or indices.max() >= len(co):
+            return
+        co[indices] += offsets
+        self.changed.add(name)
+        self.file.write(encode_record(JOURNAL_OFFSET, name, indices, offsets))
+
+    #Atomically replace the journal with a new file at path holding the
+    # current coordinates of every tracked object, or no records if with_base
+    # is False.  Objects with changes are written as snapshots so that the
+    # compacted file still counts as holding changes.
+    def __compact(self, path, with_base):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(journal_header.pack(journal_magic, journal_version))
+            if with_base:
+                for name, co in self.coords.items():
+                    f.write(encode_record(JOURNAL_SNAPSHOT if name in self.changed else JOURNAL_BASE, name, None, co))
+            else:
+                self.changed.clear()
+            f.flush()
+            os.fsync(f.fileno())
+
+        if self.file != None:
+            self.file.close()
+        os.replace(tmp_path, path)
+        if path != self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = path
+        self.file = open(path, "ab")
@@ -0,0 +1,80 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import bpy
+import math
+import numpy as np
+
+#Image name -> mip pyramid of luminance arrays, largest first.  Filled the
+# first time an image is stamped and cleared when a brush session starts so
+# that edits to the image are picked up.
+stamp_pyramids = {}
+
+def clear_stamp_pyramids():
+    stamp_pyramids.clear()
+
+def stamp_memory_usage():
+    return {name: sum(level.nbytes for level in pyramid) for name, pyramid in stamp_pyramids.items()}
+
+#Returns the luminance of each pixel of image as a (height, width) array
+def read_image_luminance(image):
+    width, height = image.size
+    channels = image.channels
+    pixels = np.empty(width * height * channels, dtype = np.float32)
+    image.pixels.foreach_get(pixels)
+    pixels = pixels.reshape((height, width, channels))
+    if channels < 3:
+        return pixels[:, :, 0].copy()
+    return pixels[:, :, 0] * .2126 + pixels[:, :, 1] * .7152 + pixels[:, :, 2] * .0722
+
+#Halve the image size at each level by averaging blocks of 2x2 pixels until
+# one side is a single pixel
+def build_mip_pyramid(lum):
+    pyramid = [lum]
+    while min(lum.shape) > 1:
+        h = lum.shape[0] & ~1
+        w = lum.shape[1] & ~1
+        lum = lum[:h, :w]
+        lum = (lum[0::2, 0::2] + lum[1::2, 0::2] + lum[0::2, 1::2] + lum[1::2, 1::2]) * .25
+        pyramid.append(lum)
+    return pyramid
+
+def get_stamp_pyramid(image):
+    pyramid = stamp_pyramids.get(image.name)
+    if pyramid is None:
+        pyramid = build_mip_pyramid(read_image_luminance(image))
+        stamp_pyramids[image.name] = pyramid
+    return pyramid
+
+def sample_bilinear(lum, uv):
+    height, width = lum.shape
+    f = np.clip(uv, 0, 1) * (width, height) - .5
+    f = np.clip(f, 0, (width - 1, height - 1))
+    i0 = f.astype(np.int64)
+    i1 = np.minimum(i0 + 1, (width - 1, height - 1))
+    t = f - i0
+    tx = t[:, 0]
+    ty = t[:, 1]
+    top = lum[i0[:, 1], i0[:, 0]] * (1 - tx) + lum[i0[:, 1], i1[:, 0]] * tx
+    bottom = lum[i1[:, 1], i0[:, 0]] * (1 - tx) + lum[i1[:, 1], i1[:, 0]] * tx
+    return top * (1 - ty) + bottom * ty
+
+#Sample the pyramid at each uv in [0, 1], using the level whose pixels are
+# closest to samples_across samples over the width of the image so that
+# pixels between the vertices are averaged rather than skipped
+def sample_stamp(pyramid, uv, samples_across):
+    width = pyramid[0].shape[1]
+    level = int(math.floor(math.log2(max(width / max(samples_across, 1), 1))))
+    return sample_bilinear(pyramid[min(level, len(pyramid) - 1)], uv)
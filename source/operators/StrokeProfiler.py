@@ -0,0 +1,79 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import bpy
+import cProfile
+import io
+import os
+import pstats
+import tempfile
+import time
+
+#Number of functions listed in the text summary
+profile_summary_lines = 40
+
+#Path without extension for profile output.  Placed next to the blend file,
+# or in the temporary directory if the file has not been saved.
+def profile_output_base():
+    stamp = time.strftime("%Y%m%d_%H%M%S")
+    filepath = bpy.data.filepath
+    if filepath:
+        return os.path.splitext(filepath)[0] + "_stroke_profile_" + stamp
+    return os.path.join(tempfile.gettempdir(), "untitled_stroke_profile_" + stamp)
+
+#Runs cProfile while each of the next stroke_count strokes is drawn
+class StrokeProfiler:
+    def __init__(self, stroke_count):
+        self.profile = cProfile.Profile()
+        self.stroke_count = stroke_count
+        self.strokes_left = stroke_count
+        self.active = False
+
+    def begin_stroke(self):
+        if self.active or self.strokes_left <= 0:
+            return
+        self.active = True
+        self.profile.enable()
+
+    #Returns True once the last stroke has been captured
+    def end_stroke(self):
+        if not self.active:
+            return False
+        self.profile.disable()
+        self.active = False
+        self.strokes_left -= 1
+        return self.strokes_left <= 0
+
+    #Turn the profiler off even if a stroke is still being captured.  The
+    # partial stroke counts as captured.
+    def stop(self):
+        self.end_stroke()
+
+    #True if any stroke has been captured
+    def has_strokes(self):
+        return self.strokes_left < self.stroke_count
+
+    #Write the raw profile as .prof and the top functions by cumulative time
+    # as .txt.  Returns the path of the .prof file.
+    def save(self, base_path):
+        self.profile.dump_stats(base_path + ".prof")
+
+        out = io.StringIO()
+        stats = pstats.Stats(self.profile, stream = out)
+        stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(profile_summary_lines)
+        with open(base_path + ".txt", "w") as f:
+            f.write(out.getvalue())
+
+        return base_path + ".prof"
@@ -0,0 +1,65 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+from .SculptHistory import *
+
+#Number of vertices transformed at a time by terrace_object.  Keeps the
+# float64 temporaries small on very large meshes; the coordinates themselves
+# are still held whole.
+terrace_chunk_size = 1 << 18
+
+#Snap heights onto steps step apart, starting at offset.  The first
+# sharpness fraction of each step is flat and the rest rises evenly to the
+# next step, so a sharpness of 0 leaves heights alone and 1 makes vertical
+# risers.
+def terrace_heights(height, step, sharpness, offset):
+    t = (height - offset) / step
+    level = np.floor(t)
+    rise = np.clip((t - level - sharpness) / max(1 - sharpness, 1e-6), 0, 1)
+    return (level + rise) * step + offset
+
+#Terrace every vertex of obj.  Heights are measured along +Z from the
+# terrain origin in flat mode and away from it in sphere mode.  The
+# coordinates are read and written with one bulk call each, since foreach_get
+# and foreach_set cannot work on part of a mesh; only the math in between is
+# done in chunks.  Returns True if the mesh was changed.
+def terrace_object(obj, step, sharpness, offset, terrain_origin, world_shape_type):
+    co = read_vertex_coords(obj)
+    xform = np.array(obj.matrix_world, dtype = np.float64)
+    inverse = np.linalg.inv(xform[:3, :3])
+    origin = np.array(terrain_origin, dtype = np.float64)
+
+    changed = False
+    for start in range(0, len(co), terrace_chunk_size):
+        chunk = co[start:start + terrace_chunk_size]
+        world = chunk @ xform[:3, :3].T + xform[:3, 3]
+        if world_shape_type == 'FLAT':
+            height = world[:, 2] - origin[2]
+            world[:, 2] += terrace_heights(height, step, sharpness, offset) - height
+        else:
+            offset_from_origin = world - origin
+            height = np.linalg.norm(offset_from_origin, axis = 1)
+            scale = terrace_heights(height, step, sharpness, offset) / np.maximum(height, 1e-12)
+            world = origin + offset_from_origin * scale[:, np.newaxis]
+
+        local = ((world - xform[:3, 3]) @ inverse.T).astype(np.float32)
+        changed |= bool(np.any(local != chunk))
+        co[start:start + terrace_chunk_size] = local
+
+    if changed:
+        obj.data.vertices.foreach_set("co", co.ravel())
+        obj.data.update()
+    return changed
@@ -0,0 +1,83 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import bpy
+import os
+from bpy.app.handlers import persistent
+from .SculptJournal import *
+
+#Once the blend file is saved it holds every change so far, so the journal
+# starts over next to the saved file
+@persistent
+def journal_save_post(*args):
+    journal = get_sculpt_journal()
+    if journal != None:
+        journal.reset(journal_path())
+
+#The journal belongs to the file being closed.  Anything not yet saved stays
+# on disk to be recovered when that file is opened again.
+@persistent
+def journal_load_pre(*args):
+    close_sculpt_journal()
+
+def register_journal_handlers():
+    bpy.app.handlers.save_post.append(journal_save_post)
+    bpy.app.handlers.load_pre.append(journal_load_pre)
+
+def unregister_journal_handlers():
+    if journal_save_post in bpy.app.handlers.save_post:
+        bpy.app.handlers.save_post.remove(journal_save_post)
+    if journal_load_pre in bpy.app.handlers.load_pre:
+        bpy.app.handlers.load_pre.remove(journal_load_pre)
+    close_sculpt_journal()
+
+#--------------------------------------
+
+class TerrainRecoverJournalOperator(bpy.types.Operator):
+    """Replay the sculpt journal left by a crashed session onto the meshes of this file"""
+    bl_idname = "kitfox.terrain_recover_journal"
+    bl_label = "Recover Sculpt Journal"
+    bl_options = {"REGISTER", "UNDO"}
+
+    @classmethod
+    def poll(cls, context):
+        return has_unrecovered_journal()
+
+    def execute(self, context):
+        path = journal_path()
+        count, skipped = recover_journal(path)
+        os.remove(path)
+
+        if skipped > 0:
+            self.report({'WARNING'}, "Recovered sculpting on %d objects.  Skipped %d objects whose vertex count has changed." % (count, skipped))
+        else:
+            self.report({'INFO'}, "Recovered sculpting on %d objects" % count)
+        return {'FINISHED'}
+
+class TerrainDiscardJournalOperator(bpy.types.Operator):
+    """Delete the sculpt journal left by a crashed session without applying it"""
+    bl_idname = "kitfox.terrain_discard_journal"
+    bl_label = "Discard Sculpt Journal"
+    bl_options = {"REGISTER"}
+
+    @classmethod
+    def poll(cls, context):
+        return has_unrecovered_journal()
+
+    def execute(self, context):
+        os.remove(journal_path())
+
+        self.report({'INFO'}, "Discarded sculpt journal")
+        return {'FINISHED'}
@@ -0,0 +1,69 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import bpy
+import os
+from bpy_extras.io_utils import ExportHelper
+from .PerfMetrics import *
+
+
+class TerrainExportPerfMetricsOperator(bpy.types.Operator, ExportHelper):
+    """Write the brush timing records to a CSV or JSON file"""
+    bl_idname = "kitfox.terrain_export_perf_metrics"
+    bl_label = "Export Brush Metrics"
+    bl_options = {"REGISTER"}
+
+    filename_ext = ".csv"
+
+    filter_glob : bpy.props.StringProperty(
+        default = "*.csv;*.json",
+        options = {'HIDDEN'}
+    )
+
+    file_format : bpy.props.EnumProperty(
+        items=(
+            ('CSV', "CSV", "Comma separated values, one record per row"),
+            ('JSON', "JSON", "JSON object holding a list of records"),
+        ),
+        name = "Format",
+        default = 'CSV'
+    )
+
+    clear : bpy.props.BoolProperty(
+        name = "Clear After Export",
+        description = "Empty the record buffer once it has been written.",
+        default = False
+    )
+
+    def execute(self, context):
+        metrics = get_perf_metrics()
+        if len(metrics) == 0:
+            self.report({'WARNING'}, "No brush metrics have been recorded")
+            return {'CANCELLED'}
+
+        ext = ".json" if self.file_format == 'JSON' else ".csv"
+        path = os.path.splitext(self.filepath)[0] + ext
+
+        records = metrics.records()
+        if self.file_format == 'JSON':
+            write_perf_json(path, records)
+        else:
+            write_perf_csv(path, records)
+
+        if self.clear:
+            metrics.clear()
+
+        self.report({'INFO'}, "Wrote %d records to %s" % (len(records), path))
+        return {'FINISHED'}
@@ -22,12 +22,31 @@ import gpu
 import mathutils
 import math
 import bmesh
+import time
+import numpy as np
+from collections import deque
 from ..kitfox.math.vecmath import *
 from ..kitfox.blenderUtil import *
+from ..kitfox.gui.graphics import DrawContext2D
 from .Common import *
 from .SmoothingInfo import *
 from .TerrainSculptMeshProperties import *
 from .TerrainHeightPickerMeshOperator import *
+from .TileIndex import *
+from .SculptHistory import *
+from .SculptJournal import *
+from .HeightField import *
+from .PerfMetrics import *
+from .StrokeProfiler import *
+from .MemoryAccounting import *
+from .BrushRegion import *
+from .HydraulicErosion import *
+from .ThermalErosion import *
+from .NoiseTiles import *
+from .StampImage import *
+from .Terrace import *
+from .ChannelCarve import *
+from .BrushMask import *
 
 from gpu_extras.batch import batch_for_shader
 from bpy_extras import view3d_utils
@@ -39,184 +58,143 @@ batchSquare = batch_for_shader(shader, 'LINE_STRIP', {"pos": coordsSquare_strip}
 
 brush_radius_increment = .9
 
+#Shortest time in seconds between viewport redraws requested by the brush
+redraw_interval = 1 / 60
+
+#Seconds between refreshes of the performance HUD text
+hud_refresh_interval = .25
+
+#The draped brush footprint is rebuilt once the cursor moves this fraction of
+# the brush radius
+footprint_move_threshold = .05
+
+#Height the footprint is lifted above the terrain as a fraction of the brush
+# radius so that it is not hidden by the surface
+footprint_lift = .01
+
+footprint_matrix = mathutils.Matrix.Identity(4)
+
+#Brushes that work on all vertices under the brush at once through a
+# BrushRegion rather than one vertex at a time
+array_brush_types = ('EROSION', 'THERMAL', 'NOISE', 'STAMP', 'TERRACE')
+
 #--------------------------------------
 
+#Draws the performance HUD text cached by update_hud()
 def draw_viewport_callback(self, context):
-    pass
+    if not self.show_hud or context.area != self.area:
+        return
 
+    ctx = DrawContext2D(context)
+    ctx.set_font_size(12)
+    ctx.set_font_dpi(72)
 
-def find_area():
-    try:
-        for a in bpy.data.window_managers[0].windows[0].screen.areas:
-            if a.type == "VIEW_3D":
-                return a
-        return None
-    except:
-        return None
+    line_height = 16
+    gpu.state.blend_set('ALPHA')
+    ctx.set_color((0, 0, 0, .5))
+    ctx.fill_round_rectangle(10, 10, 320, line_height * len(self.hud_lines) + 10, 6)
+    gpu.state.blend_set('NONE')
 
-def draw_circle(mCursor):    
-    #Tangent to mesh
-    gpu.matrix.push()
-    
-    gpu.matrix.multiply_matrix(mCursor)
+    for i, line in enumerate(self.hud_lines):
+        ctx.draw_text(line, 18, 10 + line_height * (i + 1))
 
-    shader.uniform_float("color", (1, 0, 1, 1))
-    batchCircle.draw(shader)
-    gpu.matrix.pop()
 
+#Uses the projection of the viewport cached by the operator's update_view()
 def get_adjust_brush_viewport_scale(self, radius_relative_to_view_scale):
-    area = find_area()
-    if area:
-        #RegionView3D
-        r3d = area.spaces[0].region_3d
-        proj_mat = r3d.window_matrix
-        
-        if r3d.is_perspective and self.cursor_pos:
-            cam_offset = self.cursor_pos - self.ray_origin
-            brush_scale = cam_offset.length * radius_relative_to_view_scale / proj_mat[1][1]
-            #print("self.cursor_pos ", self.cursor_pos, " self.ray_origin ", self.ray_origin, " brush_scale ", brush_scale)
-            # brush_radius = brush_radius * brush_scale
-            # inner_radius = inner_radius * brush_scale
-            return brush_scale
+    if self.view_is_perspective and self.cursor_pos:
+        cam_offset = self.cursor_pos - self.ray_origin
+        brush_scale = cam_offset.length * radius_relative_to_view_scale / self.view_proj_scale
+        return brush_scale
     
     return 1
     
 
-def draw_callback(self, context):
-    ctx = bpy.context
-
-    region = context.region
-    rv3d = context.region_data
-
-    viewport_center = (region.x + region.width / 2, region.y + region.height / 2)
-    view_vector = view3d_utils.region_2d_to_vector_3d(region, rv3d, viewport_center)
-    ray_origin = view3d_utils.region_2d_to_origin_3d(region, rv3d, viewport_center)
-
-    props = context.scene.terrain_sculpt_mesh_brush_props
-    brush_radius = props.radius
-    inner_radius = props.inner_radius
+#Returns a list of (matrix, batch) pairs that draw the brush cursor
+def calc_cursor_geometry(self, props, terrain_origin, brush_scale):
+    brush_radius = props.radius * brush_scale
+    inner_radius = props.inner_radius * brush_scale
     brush_type = props.brush_type
-    ramp_width = props.ramp_width
-    draw_height = props.draw_height
     world_shape_type = props.world_shape_type
-    terrain_origin_obj = props.terrain_origin
-    radius_relative_to_view = props.radius_relative_to_view
-    radius_relative_to_view_scale = props.radius_relative_to_view_scale
-
-    terrain_origin = vecZero.copy()
-    if terrain_origin_obj != None:
-        terrain_origin = terrain_origin_obj.matrix_world.translation
-
-    shader.bind();
-
-#    print("draw_callback")
-
-    if radius_relative_to_view:
-        brush_scale = get_adjust_brush_viewport_scale(self, radius_relative_to_view_scale)
-        brush_radius = brush_radius * brush_scale
-        inner_radius = inner_radius * brush_scale
 
-    #Draw cursor
-    if self.show_cursor:
+    if brush_type == 'RAMP':
+        if not self.dragging:
+            return []
 
-        if brush_type == 'RAMP':
-            if self.dragging:
-                ramp_start = self.start_location
-                ramp_span = self.cursor_pos - ramp_start
-                
-                if ramp_span.length_squared > .001:
-
-                    if world_shape_type == 'FLAT':
-                        up = vecZ
-                    else:
-                        up = self.start_location - terrain_origin
-                        up.normalize()
-                                        
-                    binormal = ramp_span.normalized()
-                    tangent = binormal.cross(up)
-                    normal = tangent.cross(binormal)
-                    
-                    m = create_matrix(tangent, binormal, normal, self.start_location)
-
-                    #m = calc_vertex_transform_world(self.start_location, normal);
-                    mS = mathutils.Matrix.Diagonal((ramp_width * 2, ramp_span.length, 1, 1))
-                    mT = mathutils.Matrix.Translation((-.5, 0, 0))
-                    
-                    mCursor = m @ mS @ mT
-                    
-                    
-                    gpu.matrix.push()
-                    
-                    gpu.matrix.multiply_matrix(mCursor)
+        ramp_start = self.start_location
+        ramp_span = self.cursor_pos - ramp_start
+        if ramp_span.length_squared <= .001:
+            return []
 
-                    shader.uniform_float("color", (1, 0, 1, 1))
-                    batchSquare.draw(shader)
-                    gpu.matrix.pop()
-                    
-        elif brush_type == 'DRAW':
- #           print("drawing DRAW brush")
-                
-                # print("found radius check")
-                # area = find_area()
-                # if area:
-                    # #RegionView3D
-                    # r3d = area.spaces[0].region_3d
-                    # proj_mat = r3d.window_matrix
-                    
-                    # if r3d.is_perspective:
-                        # cam_offset = self.cursor_pos - self.ray_origin
-                        # brush_scale = cam_offset.length * radius_relative_to_view_scale / proj_mat[1][1]
-                        # #print("self.cursor_pos ", self.cursor_pos, " self.ray_origin ", self.ray_origin, " brush_scale ", brush_scale)
-                        # brush_radius = brush_radius * brush_scale
-                        # inner_radius = inner_radius * brush_scale
-                    
-                
+        if world_shape_type == 'FLAT':
+            up = vecZ
+        else:
+            up = self.start_location - terrain_origin
+            up.normalize()
+                            
+        binormal = ramp_span.normalized()
+        tangent = binormal.cross(up)
+        normal = tangent.cross(binormal)
         
-            offset_from_origin = self.cursor_pos - terrain_origin
-            if world_shape_type == 'FLAT':
-#                            print("world_shape_type " + str(world_shape_type))
-                offset_from_origin = offset_from_origin.project(vecZ)
-                down = -vecZ
-            else:
-                down = -offset_from_origin.normalized()
-                
-            draw_pos = self.cursor_pos - offset_from_origin - down * draw_height
-            m = calc_vertex_transform_world(draw_pos, -down);
+        m = create_matrix(tangent, binormal, normal, self.start_location)
 
-            draw_base_pos = self.cursor_pos - offset_from_origin
-            mBase = calc_vertex_transform_world(draw_base_pos, -down);
-            
-            #outer
-            mS = mathutils.Matrix.Scale(brush_radius, 4)
-            mCursor = m @ mS
+        mS = mathutils.Matrix.Diagonal((props.ramp_width * 2, ramp_span.length, 1, 1))
+        mT = mathutils.Matrix.Translation((-.5, 0, 0))
         
-            draw_circle(mCursor)
+        return [(m @ mS @ mT, batchSquare)]
+                
+    elif brush_type == 'CARVE':
+        m = calc_vertex_transform_world(self.cursor_pos, self.cursor_normal);
+        draws = [(m @ mathutils.Matrix.Scale(props.carve_width, 4), batchCircle)]
+        if self.dragging and len(self.stroke_trail) > 1:
+            batch = batch_for_shader(shader, 'LINE_STRIP', {"pos": [p.to_tuple() for p in self.stroke_trail] + [self.cursor_pos.to_tuple()]})
+            draws.append((footprint_matrix, batch))
+        return draws
+
+    elif brush_type == 'DRAW':
+        offset_from_origin = self.cursor_pos - terrain_origin
+        if world_shape_type == 'FLAT':
+            offset_from_origin = offset_from_origin.project(vecZ)
+            down = -vecZ
+        else:
+            down = -offset_from_origin.normalized()
             
-            draw_circle(mBase @ mS)
+        draw_pos = self.cursor_pos - offset_from_origin - down * props.draw_height
+        m = calc_vertex_transform_world(draw_pos, -down);
 
-            #inner
-            mS = mathutils.Matrix.Scale(brush_radius * inner_radius, 4)
-            mCursor = m @ mS
+        draw_base_pos = self.cursor_pos - offset_from_origin
+        mBase = calc_vertex_transform_world(draw_base_pos, -down);
         
-            draw_circle(mCursor)
-            draw_circle(mBase @ mS)
+        mOuter = mathutils.Matrix.Scale(brush_radius, 4)
+        mInner = mathutils.Matrix.Scale(brush_radius * inner_radius, 4)
         
-        else:
-            
-            #Orient to mesh surface
-            m = calc_vertex_transform_world(self.cursor_pos, self.cursor_normal);
-            
-            #outer
-            mS = mathutils.Matrix.Scale(brush_radius, 4)
-            mCursor = m @ mS
+        return [(m @ mOuter, batchCircle), (mBase @ mOuter, batchCircle), 
+            (m @ mInner, batchCircle), (mBase @ mInner, batchCircle)]
+    
+    else:
+        if world_shape_type == 'FLAT' and self.height_field != None:
+            return self.calc_footprint((brush_radius, brush_radius * inner_radius))
+        
+        #Orient to mesh surface
+        m = calc_vertex_transform_world(self.cursor_pos, self.cursor_normal);
+        
+        mOuter = mathutils.Matrix.Scale(brush_radius, 4)
+        mInner = mathutils.Matrix.Scale(brush_radius * inner_radius, 4)
 
-            draw_circle(mCursor)
+        return [(m @ mOuter, batchCircle), (m @ mInner, batchCircle)]
 
-            #inner
-            mS = mathutils.Matrix.Scale(brush_radius * inner_radius, 4)
-            mCursor = m @ mS
-            
-            draw_circle(mCursor)
+#Draws the cursor geometry cached by update_cursor_geometry()
+def draw_callback(self, context):
+    if not self.show_cursor or len(self.cursor_draws) == 0:
+        return
+
+    shader.bind();
+    shader.uniform_float("color", (1, 0, 1, 1))
+    
+    for mCursor, batch in self.cursor_draws:
+        gpu.matrix.push()
+        gpu.matrix.multiply_matrix(mCursor)
+        batch.draw(shader)
+        gpu.matrix.pop()
         
 
 def rotate_axis_angle(vector, axis, angle):
@@ -243,98 +221,303 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
         self.show_cursor = False
         self.edit_object = None
         self.stroke_trail = []
-
-        self.history = []
-        self.history_idx = -1
-        self.history_limit = 10
-        self.history_bookmarks = {}
-
-        
-    def free_snapshot(self, map):
-        for obj in map:
-            bm = map[obj]
-            bm.free()
+        self.tile_index = None
+        self.height_field = None
+        self.edge_cache = None
+        self.vertex_cache = None
+        self.brush_mask = None
+        self.footprint_cache = None
+        self.cursor_key = None
+        self.cursor_draws = []
+        self.area = None
+        self.region = None
+        self.rv3d = None
+        self.view_dirty = True
+        self.view_is_perspective = False
+        self.view_proj_scale = 1
+        self.redraw_pending = False
+        self.last_redraw_time = 0
+        self.window = None
+        self._timer = None
+
+        self.show_hud = False
+        self.hud_lines = []
+        self.hud_time = 0
+        self.dab_perf = None
+        self.dab_times = deque(maxlen = 120)
+
+        self.history = SculptHistory()
+        self.stroke_dirty = StrokeDirtySet()
+        self.journal = None
+        self.profiler = None
+        self.memory_warned = False
 
     #if bookmark is other than -1, snapshot added to bookmark library rather than undo stack
     def history_snapshot(self, context, bookmark = -1):
-        map = {}
-        for obj in context.selected_objects:
-            if obj.type == 'MESH':
-                bm = bmesh.new()
-                
-                mesh = obj.data
-                bm.from_mesh(mesh)
-                map[obj] = bm
-                
         if bookmark != -1:
-            self.history_bookmarks[bookmark] = map
-                
-        else:
-            #Remove first element if history queue is maxed out
-            if self.history_idx == self.history_limit:
-                self.free_snapshot(self.history[0])
-                self.history.pop(0)
+            #Bookmark 0 is used to restore the meshes if the tool is cancelled
+            self.history.add_bookmark(bookmark, self.tile_index.objects, protected = bookmark == 0)
             
-                self.history_idx += 1
-
-            #Remove all history past current pointer
-            while self.history_idx < len(self.history) - 1:
-                self.free_snapshot(self.history[-1])
-                self.history.pop()
-                    
-            self.history.append(map)
-            self.history_idx += 1
+        elif not self.stroke_dirty.is_empty():
+            with PerfTimer('snapshot'):
+                chunks = self.stroke_dirty.take()
+                self.history.push(HistoryEntry(chunks))
+                if self.journal != None:
+                    self.journal.record_stroke(chunks)
         
     def history_undo(self, context):
-        if (self.history_idx == 0):
-            return
-            
-        self.history_undo_to_snapshot(context, self.history_idx - 1)
+        changes = self.history.undo()
+        self.record_offsets(changes)
+        self.request_redraw()
                 
     def history_redo(self, context):
-        if (self.history_idx == len(self.history) - 1):
+        changes = self.history.redo()
+        self.record_offsets(changes)
+        self.request_redraw()
+        
+    #Pass the (obj, indices, offsets, after) applied by undo or redo on to the
+    # caches and the journal.  The height field is updated in place like it is
+    # for a dab rather than rebuilt.
+    def record_offsets(self, changes):
+        if not changes:
             return
+        for obj, indices, offsets, after in changes:
+            self.tile_index.include_points(obj, after)
+            self.height_field.update(obj, after - offsets, after)
+            self.vertex_cache.update(obj, indices, after)
+        if self.journal != None:
+            self.journal.record_offsets(changes)
 
-        self.history_undo_to_snapshot(context, self.history_idx + 1)
-            
-        
     def history_restore_bookmark(self, context, bookmark):
-        map = self.history[bookmark]
-    
-        for obj in context.selected_objects:
-            if obj.type == 'MESH':
-                bm = map[obj]
-                
-                mesh = obj.data
-                bm.to_mesh(mesh)
-                mesh.update()
-        
-    def history_undo_to_snapshot(self, context, idx):
-        if idx < 0 or idx >= len(self.history):
-            return
-            
-        self.history_idx = idx
-       
-        map = self.history[self.history_idx]
-        
-        for obj in context.selected_objects:
-            if obj.type == 'MESH':
-                bm = map[obj]
-                
-                mesh = obj.data
-                bm.to_mesh(mesh)
-                mesh.update()
+        restored = self.history.restore_bookmark(bookmark)
+        for obj, co in restored:
+            self.vertex_cache.discard(obj)
+        if restored and self.journal != None:
+            self.journal.record_coords(restored)
+        self.height_field.mark_dirty()
         
+    #Stop recording if the journal writer has failed
+    def check_journal(self):
+        if self.journal != None and self.journal.error != None:
+            self.report({'WARNING'}, "Sculpt journal disabled: " + self.journal.error)
+            self.journal = None
+
     def history_clear(self, context):
-        for key in self.history_bookmarks:
-            map = self.history_bookmarks[key]
-            self.free_snapshot(map)
-    
-        for map in self.history:
-            self.free_snapshot(map)
-                
-        self.history = []
-        self.history_idx = -1
+        self.history.clear()
+        self.stroke_dirty = StrokeDirtySet()
+
+    #Recompute the cursor matrices drawn by draw_callback.  Nothing is
+    # recomputed unless the cursor or the brush settings it depends on changed.
+    def update_cursor_geometry(self, context):
+        if not self.show_cursor or self.cursor_pos == None:
+            if self.cursor_key != None:
+                self.cursor_key = None
+                self.request_redraw()
+            return
+
+        props = context.scene.terrain_sculpt_mesh_brush_props
+
+        brush_scale = 1
+        if props.radius_relative_to_view:
+            brush_scale = get_adjust_brush_viewport_scale(self, props.radius_relative_to_view_scale)
+
+        terrain_origin = vecZero.copy()
+        if props.terrain_origin != None:
+            terrain_origin = props.terrain_origin.matrix_world.translation.copy()
+
+        key = (props.brush_type, props.radius, props.inner_radius, props.ramp_width, 
+            props.draw_height, props.world_shape_type, terrain_origin.to_tuple(), brush_scale, 
+            self.cursor_pos.to_tuple(), self.cursor_normal.to_tuple(), self.dragging, 
+            self.start_location.to_tuple() if self.dragging else None, 
+            self.height_field.version, props.carve_width, len(self.stroke_trail))
+        if key == self.cursor_key:
+            return
+
+        self.cursor_key = key
+        self.cursor_draws = calc_cursor_geometry(self, props, terrain_origin, brush_scale)
+        self.request_redraw()
+
+    #Returns (matrix, batch) pairs for rings of the given radii around the cursor
+    # with their points dropped onto the height field
+    def calc_footprint(self, radii):
+        center = np.array(self.cursor_pos)
+        if self.footprint_cache != None:
+            cache_center, cache_radii, cache_version, draws = self.footprint_cache
+            if cache_radii == radii and cache_version == self.height_field.version and np.linalg.norm(center[:2] - cache_center[:2]) < footprint_move_threshold * radii[0]:
+                return draws
+
+        angles = np.linspace(0, 2 * math.pi, circleSegs + 1)
+        ring = np.stack((np.sin(angles), np.cos(angles)), axis = 1)
+        xy = np.concatenate([center[:2] + ring * r for r in radii])
+        z = self.height_field.sample(xy)
+        z = np.where(np.isnan(z), center[2], z) + radii[0] * footprint_lift
+        points = np.column_stack((xy, z)).astype(np.float32).reshape((len(radii), -1, 3))
+
+        draws = [(footprint_matrix, batch_for_shader(shader, 'LINE_STRIP', {"pos": p})) for p in points]
+        self.footprint_cache = (center, radii, self.height_field.version, draws)
+        return draws
+
+    #Cache the projection of the viewport the operator was started in.  Called
+    # again after events passed through to Blender, which may move the view.
+    def update_view(self):
+        self.view_is_perspective = self.rv3d.is_perspective
+        self.view_proj_scale = self.rv3d.window_matrix[1][1]
+        self.view_dirty = False
+
+    def register_memory_providers(self):
+        register_memory_provider("Undo History", self.history.memory_usage)
+        register_memory_provider("Tile Index", self.tile_index.memory_usage)
+        register_memory_provider("Height Field", self.height_field.memory_usage)
+        register_memory_provider("Edge Cache", self.edge_cache.memory_usage)
+        register_memory_provider("Vertex Cache", self.vertex_cache.memory_usage)
+        register_memory_provider("Brush Mask", self.brush_mask.memory_usage)
+
+    #Rebuild the tile index and height field if the selected meshes have
+    # changed since they were built.  Newly selected tiles are added to the
+    # bookmark Esc restores.
+    def check_selection(self, context):
+        selected = [obj for obj in context.selected_objects if obj.type == 'MESH']
+        if selected == self.tile_index.objects:
+            return
+
+        self.tile_index = TileIndex(selected)
+        self.height_field = HeightField(self.tile_index.objects)
+        self.footprint_cache = None
+        self.vertex_cache.retain(self.tile_index.objects)
+        self.history.extend_bookmark(0, self.tile_index.objects)
+        props = context.scene.terrain_sculpt_mesh_brush_props
+        self.brush_mask.update(self.tile_index.objects, props.mask_type, props.mask_name, props.mask_invert)
+        self.register_memory_providers()
+        self.request_redraw()
+
+    def unregister_memory_providers(self):
+        unregister_memory_provider("Undo History")
+        unregister_memory_provider("Tile Index")
+        unregister_memory_provider("Height Field")
+        unregister_memory_provider("Edge Cache")
+        unregister_memory_provider("Vertex Cache")
+        unregister_memory_provider("Brush Mask")
+
+    #Warn once each time the memory held by the brush climbs close to the
+    # ceiling set in the panel
+    def check_memory(self, context):
+        ceiling = context.scene.terrain_sculpt_mesh_brush_props.memory_ceiling * 1024 * 1024
+        total = memory_total(refresh_memory_report())
+        if not is_memory_near_ceiling(total, ceiling):
+            self.memory_warned = False
+        elif not self.memory_warned:
+            self.memory_warned = True
+            self.report({'WARNING'}, "Terrain brush is using %s of its %s memory ceiling.  Lower the undo memory or save and restart the brush." % (format_bytes(total), format_bytes(ceiling)))
+
+    #Write out the strokes captured so far and turn the profiler off
+    def save_profile(self, context):
+        props = context.scene.terrain_sculpt_mesh_brush_props
+        profiler = self.profiler
+        self.profiler = None
+        props.profile_strokes = False
+        profiler.stop()
+        if not profiler.has_strokes():
+            return
+
+        try:
+            path = profiler.save(profile_output_base())
+            self.report({'INFO'}, "Saved stroke profile to " + path)
+        except OSError as e:
+            self.report({'WARNING'}, "Could not save stroke profile: " + str(e))
+
+    #Timings in seconds of the phases of the last dab.  The HUD picks them up
+    # on its next refresh.
+    def record_dab_perf(self, pick, query, brush, commit, vert_count):
+        self.dab_perf = (pick, query, brush, commit, vert_count)
+        self.dab_times.append(time.perf_counter())
+
+    #Rebuild the HUD text so that the draw callback only draws it
+    def update_hud(self):
+        now = time.perf_counter()
+        self.hud_time = now
+        lines = []
+
+        if self.dab_perf != None:
+            pick, query, brush, commit, vert_count = self.dab_perf
+            total = pick + query + brush + commit
+            lines.append("Dab %.2f ms  pick %.2f  query %.2f  brush %.2f" % (total * 1000, pick * 1000, query * 1000, brush * 1000))
+            lines.append("Mesh commit %.2f ms  vertices %d" % (commit * 1000, vert_count))
+        else:
+            lines.append("Dab -")
+
+        dabs = sum(1 for t in self.dab_times if now - t < 1)
+        lines.append("Dabs per second %d" % dabs)
+
+        stats = self.history.stats()
+        lines.append("Undo %.1f MB  disk %.1f MB  steps %d" % (stats["total_bytes"] / (1024 * 1024), stats["disk_bytes"] / (1024 * 1024), stats["entry_count"]))
+        if stats["over_budget"] != None:
+            lines.append("!  Undo over budget: %s" % stats["over_budget"])
+
+        total = memory_total(refresh_memory_report())
+        ceiling = bpy.context.scene.terrain_sculpt_mesh_brush_props.memory_ceiling * 1024 * 1024
+        warning = "!  " if is_memory_near_ceiling(total, ceiling) else ""
+        lines.append("%sMemory %s of %s" % (warning, format_bytes(total), format_bytes(ceiling)))
+
+        self.hud_lines = lines
+        self.request_redraw()
+
+    #Mark the viewport as needing a redraw.  Redraws are sent at most once
+    # every redraw_interval; requests in between are flushed by the timer.
+    def request_redraw(self):
+        self.redraw_pending = True
+        self.flush_redraw()
+
+    #The timer only runs while a redraw is pending, a stroke is being drawn or
+    # the view is being navigated, so the brush does not wake Blender while
+    # it is idle
+    def flush_redraw(self):
+        if self.redraw_pending and self.area != None:
+            now = time.perf_counter()
+            if now - self.last_redraw_time >= redraw_interval:
+                self.area.tag_redraw()
+                self.redraw_pending = False
+                self.last_redraw_time = now
+
+        if (self.redraw_pending and self.area != None) or self.dragging or self.view_dirty:
+            if self._timer == None and self.window != None:
+                self._timer = bpy.context.window_manager.event_timer_add(redraw_interval, window = self.window)
+        else:
+            self.remove_timer()
+
+    def remove_timer(self):
+        if self._timer != None:
+            bpy.context.window_manager.event_timer_remove(self._timer)
+            self._timer = None
+
+    #Release what the brush holds when it ends without Enter or Esc, either
+    # because an event handler raised or because Blender cancelled it.  Safe
+    # to call more than once.
+    def abort_session(self):
+        for handle in (self._handle, self._handle_viewport):
+            try:
+                bpy.types.SpaceView3D.draw_handler_remove(handle, 'WINDOW')
+            except ValueError:
+                pass
+        self.remove_timer()
+        if self.profiler != None:
+            self.profiler.stop()
+            self.profiler = None
+        self.unregister_memory_providers()
+        self.history.clear()
+        self.journal = None
+
+    #Pick up changes made outside the brush.  Run on timer ticks and on
+    # events other than mouse moves.
+    def check_state(self, context):
+        show_hud = context.scene.terrain_sculpt_mesh_brush_props.show_perf_hud
+        if show_hud != self.show_hud:
+            self.show_hud = show_hud
+            self.update_hud()
+        elif show_hud and time.perf_counter() - self.hud_time > hud_refresh_interval:
+            self.update_hud()
+        if not self.dragging:
+            self.check_selection(context)
+        self.check_journal()
 
     def stroke_falloff(self, x):
 #        return 1 - x * x
@@ -351,6 +534,7 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
         return (offset_from_origin, down)
 
     def dab_brush(self, context, event, start_stroke = False):
+        time_start = time.perf_counter()
         mouse_pos = (event.mouse_region_x, event.mouse_region_y)
         
         region = context.region
@@ -371,6 +555,7 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
 
 #        hit_object, location, normal, face_index, object, matrix = ray_cast_scene(context, viewlayer, ray_origin, view_vector)
         hit_object, location, normal, face_index, object, matrix = pick_object(ray_origin, view_vector)
+        time_pick = time.perf_counter()
         
         if not hit_object or object.select_get() == False or object.type != 'MESH':
             return
@@ -401,6 +586,11 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
         if terrain_origin_obj != None:
             terrain_origin = terrain_origin_obj.matrix_world.translation
     
+        if brush_type == 'CARVE':
+            #The channel is cut along the whole path when the mouse is released
+            self.add_carve_point(location, props.carve_width)
+            return
+
         if event.shift:
             #Shift key overrides for smooth mode
             brush_type = 'SMOOTH'
@@ -416,25 +606,21 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
         if start_stroke:
             self.start_height = hit_offset.dot(vecZ)
 
+        #Bounding box check for all tiles at once
+        brush_objects = self.tile_index.query(location, hit_down, brush_radius)
+        time_query = time.perf_counter()
+        commit_time = 0
+        vert_count = 0
+        verts_scanned = 0
+        perf_metrics.record('query', time_query - time_pick, objects_total = len(self.tile_index), objects_culled = len(self.tile_index) - len(brush_objects))
+
         if brush_type == 'SMOOTH':
             #Calculate relaxed location for each relevant point
 
             smoothing_info = SmoothingInfo()
             
-            for obj in context.scene.objects:
-                if not obj.select_get():
-                    continue
-
-                if obj.type != 'MESH':
-                    continue
-                    
+            for obj in brush_objects:
                 l2w = obj.matrix_world
-            
-                #Bounding box check
-                bounds = mesh_bounds_fast(obj)
-                bbox_check = bounds.intersect_with_ray(location, hit_down, brush_radius, l2w)
-                if not bbox_check:
-                    continue
                 
                 mesh = obj.data
                 if obj.mode == 'EDIT':
@@ -495,20 +681,8 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
             weight_sum = 0
             weighted_len_sum = 0
                 
-            for obj in context.scene.objects:
-                if not obj.select_get():
-                    continue
-
-                if obj.type != 'MESH':
-                    continue
-                    
+            for obj in brush_objects:
                 l2w = obj.matrix_world
-            
-                #Bounding box check
-                bounds = mesh_bounds_fast(obj)
-                bbox_check = bounds.intersect_with_ray(location, hit_down, brush_radius, l2w)
-                if not bbox_check:
-                    continue
                 
                 mesh = obj.data
                 if obj.mode == 'EDIT':
@@ -555,24 +729,17 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
                     #smooth_plane_norm = mathutils.Vector((0, 0, 1))
                     smooth_plane_norm = rotate_axis_angle(up, binorm, slope_angle * math.pi / 180)
 
+
+        if brush_type in array_brush_types:
+            brush_strength = strength * event.pressure if use_pressure else strength
+            scanned, modified, commit_time = self.dab_array_brush(props, brush_type, brush_objects, location, -hit_down, brush_radius, inner_radius, terrain_origin, world_shape_type, brush_strength)
+            verts_scanned += scanned
+            vert_count += modified
         
-        for obj in context.scene.objects:
-            if not obj.select_get():
-                continue
-            
+        for obj in brush_objects:
             l2w = obj.matrix_world
             w2l = l2w.inverted()
 
-            if obj.type != 'MESH':
-                continue
-
-            #Bounding box check
-            bounds = mesh_bounds_fast(obj)
-            bbox_check = bounds.intersect_with_ray(location, hit_down, brush_radius, l2w)
-#            print("bbox_check " + str(bbox_check))
-            if not bbox_check:
-                continue
-
 #            print("=====")
 #            print ("obj.name " + str(obj.name))
 
@@ -587,6 +754,11 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
 
             
     #                print ("location " + str(location))
+                changed_indices = []
+                before_coords = []
+                changed_coords = []
+                mask = self.brush_mask.get(obj)
+                verts_scanned += len(bm.verts)
                 for v in bm.verts:
 
                     wpos = l2w @ v.co
@@ -615,43 +787,45 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
                         atten *= strength
                         if use_pressure:
                             atten *= event.pressure
+                        if mask is not None:
+                            atten *= mask[v.index]
                             
                             
-                        len = offset_from_origin.magnitude
+                        height_len = offset_from_origin.magnitude
                         if offset_from_origin.dot(down) > 0:
-                            len = -len
+                            height_len = -height_len
                             
                         # print("---")
                         # print("wpos " + str(wpos))
                         # print("offset_from_origin " + str(offset_from_origin))
                         # print("down " + str(down))
-                        # print("len " + str(len))
+                        # print("height_len " + str(height_len))
                         # print("draw_height " + str(draw_height))
                         # print("atten " + str(atten))
                         # print("smooth_plane_pos " + str(smooth_plane_pos))
                         # print("smooth_plane_norm " + str(smooth_plane_norm))
                             
                         if brush_type == 'DRAW':
-                            new_offset = (wpos - offset_from_origin) + -down * lerp(len, draw_height, atten)
+                            new_offset = (wpos - offset_from_origin) + -down * lerp(height_len, draw_height, atten)
                         elif brush_type == 'ADD':
                             adjust = add_amount * atten
                             if event.ctrl:
                                 adjust = -adjust
-                            new_offset = (wpos - offset_from_origin) + -down * (len + adjust)
+                            new_offset = (wpos - offset_from_origin) + -down * (height_len + adjust)
                         elif brush_type == 'SUBTRACT':
                             adjust = add_amount * atten
                             if event.ctrl:
                                 adjust = -adjust
-                            new_offset = (wpos - offset_from_origin) + -down * (len - adjust)
+                            new_offset = (wpos - offset_from_origin) + -down * (height_len - adjust)
                         elif brush_type == 'LEVEL':
-                            new_offset = (wpos - offset_from_origin) + -down * lerp(len, self.start_height, atten)
+                            new_offset = (wpos - offset_from_origin) + -down * lerp(height_len, self.start_height, atten)
                         elif brush_type == 'SMOOTH':                        
                             centroid_height = smoothing_info.getCentroidHeight(wpos, terrain_origin, world_shape_type, smooth_edge_snap_distance)
-                            new_offset = (wpos - offset_from_origin) + -down * lerp(len, -centroid_height, atten)
+                            new_offset = (wpos - offset_from_origin) + -down * lerp(height_len, -centroid_height, atten)
                             # print("Applying smooth dab")
-                            # print("len " + str(len))
+                            # print("height_len " + str(height_len))
                             # print("centroid_height " + str(centroid_height))
-#                            new_offset = (wpos - offset_from_origin) + -down * lerp(len, smooth_height, atten)
+#                            new_offset = (wpos - offset_from_origin) + -down * lerp(height_len, smooth_height, atten)
                         elif brush_type == 'SLOPE':
                             if smooth_valid:
                                 s = isect_line_plane(wpos, down, smooth_plane_pos, smooth_plane_norm)
@@ -660,20 +834,188 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
                             else:
                                 new_offset = wpos
 
+                        changed_indices.append(v.index)
+                        before_coords.append(v.co[:])
                         v.co = w2l @ new_offset
+                        changed_coords.append(v.co[:])
             
+                self.record_moved(obj, changed_indices, before_coords, changed_coords)
+                vert_count += len(changed_indices)
                 
-                
+                time_commit = time.perf_counter()
                 if obj.mode == 'EDIT':
                     bmesh.update_edit_mesh(mesh)
                 elif obj.mode == 'OBJECT':
                     bm.to_mesh(mesh)
                     bm.free()
+                time_committed = time.perf_counter()
+                commit_time += time_committed - time_commit
+                perf_metrics.record('commit', time_committed - time_commit, verts_modified = len(changed_indices), objects_total = 1)
                 
                 #mesh.calc_normals_split()
 
+        time_end = time.perf_counter()
+        perf_metrics.record('dab', time_end - time_start, verts_scanned, vert_count, len(self.tile_index), len(self.tile_index) - len(brush_objects))
+        self.record_dab_perf(time_pick - time_start, time_query - time_pick, time_end - time_query - commit_time, commit_time, vert_count)
+        self.request_redraw()
+
+    #Apply a brush from array_brush_types.  Returns the number of vertices
+    # scanned and modified and the time spent writing meshes.
+    def dab_array_brush(self, props, brush_type, brush_objects, location, brush_up, brush_radius, inner_radius, terrain_origin, world_shape_type, strength):
+        region = BrushRegion(brush_objects, location, brush_up, brush_radius, inner_radius, terrain_origin, world_shape_type, vertex_cache = self.vertex_cache)
+        if len(region) == 0:
+            return (region.verts_scanned, 0, 0)
+        if self.brush_mask.is_active():
+            region.atten *= region.mask_weights(self.brush_mask)
+
+        if brush_type == 'EROSION':
+            resolution = region.grid_resolution(erosion_max_resolution)
+            grid = region.to_grid(region.height, resolution)
+            eroded = erode_grid(grid, 2 * brush_radius / resolution, props.erosion_iterations, props.erosion_rain, 
+                props.erosion_solubility, props.erosion_deposition, props.erosion_capacity, props.erosion_evaporation)
+            heights = region.height + region.sample_grid(eroded - grid) * region.atten * strength
+
+        elif brush_type == 'THERMAL':
+            ids, count, edges = region.welded_edges(self.edge_cache, props.smooth_edge_snap_distance)
+            weld_count = np.bincount(ids, minlength = count)
+            welded = np.bincount(ids, weights = region.height, minlength = count) / weld_count
+            uv = np.zeros((count, 2))
+            uv[ids] = region.uv
+            edge_length = np.linalg.norm(uv[edges[:, 0]] - uv[edges[:, 1]], axis = 1)
+            relaxed, steps = relax_talus(welded, edges, edge_length, props.talus_angle, props.thermal_iterations, props.thermal_rate)
+            heights = region.height + (relaxed - welded)[ids] * region.atten * strength
+
+        elif brush_type == 'NOISE':
+            ridged = props.noise_type == 'RIDGED'
+            if world_shape_type == 'FLAT':
+                noise = fractal_noise(region.world[:, :2] / props.noise_scale, props.noise_seed, props.noise_octaves, ridged)
+            else:
+                noise = triplanar_noise(region.world / props.noise_scale, region.up, props.noise_seed, props.noise_octaves, ridged)
+            heights = region.height + noise * props.noise_amount * region.atten * strength
+
+        elif brush_type == 'STAMP':
+            image = props.stamp_image
+            if image == None or image.size[0] == 0 or image.size[1] == 0:
+                return (region.verts_scanned, 0, 0)
+            c = math.cos(props.stamp_rotation)
+            s = math.sin(props.stamp_rotation)
+            uv = region.uv @ np.array(((c, -s), (s, c))) / (2 * brush_radius) + .5
+            samples_across = region.grid_resolution(image.size[0])
+            stamp = sample_stamp(get_stamp_pyramid(image), uv, samples_across)
+            heights = region.height + stamp * props.stamp_height * region.atten * strength
+
+        elif brush_type == 'TERRACE':
+            if props.terrace_step <= 0:
+                return (region.verts_scanned, 0, 0)
+            terraced = terrace_heights(region.height, props.terrace_step, props.terrace_sharpness, props.terrace_offset)
+            heights = region.height + (terraced - region.height) * region.atten * strength
+
+        vert_count, commit_time = self.commit_region(region, heights)
+        return (region.verts_scanned, vert_count, commit_time)
+
+    #Let the caches and the stroke know that vertices of obj have moved
+    def record_moved(self, obj, indices, before, after):
+        self.tile_index.include_points(obj, after)
+        self.height_field.update(obj, before, after)
+        self.vertex_cache.update(obj, indices, after)
+        self.stroke_dirty.add(obj, indices, before, after)
+
+    #Write new heights for a BrushRegion and record the moved vertices.
+    # Returns the number of vertices moved and the time spent.
+    def commit_region(self, region, heights):
+        time_commit = time.perf_counter()
+        changes = region.commit(heights)
+        vert_count = 0
+        for obj, indices, before, after in changes:
+            self.record_moved(obj, indices, before, after)
+            vert_count += len(indices)
+        commit_time = time.perf_counter() - time_commit
+        perf_metrics.record('commit', commit_time, verts_modified = vert_count, objects_total = len(changes))
+        return (vert_count, commit_time)
+
+    #Add the point under the cursor to the path of the carve brush
+    def add_carve_point(self, location, carve_width):
+        if len(self.stroke_trail) > 0 and (location - self.stroke_trail[-1]).length < carve_width * carve_point_spacing:
+            return
+        self.stroke_trail.append(location.copy())
+        self.request_redraw()
+
+    #Add the point under the cursor when the mouse is released, which
+    # add_carve_point may have skipped as too close to the last one
+    def end_carve_path(self, context, event):
+        mouse_pos = (event.mouse_region_x, event.mouse_region_y)
+        view_vector = view3d_utils.region_2d_to_vector_3d(context.region, context.region_data, mouse_pos)
+        ray_origin = view3d_utils.region_2d_to_origin_3d(context.region, context.region_data, mouse_pos)
+        result, location, normal, face_index, object, matrix = pick_object(ray_origin, view_vector)
+
+        if not result or object.select_get() == False or object.type != 'MESH':
+            return
+        if len(self.stroke_trail) > 0 and location == self.stroke_trail[-1]:
+            return
+        self.stroke_trail.append(location.copy())
+
+    #Cut a channel along the path traced by the stroke.  The bed follows the
+    # lowest ground the path has crossed so far so that it always runs
+    # downhill from where the stroke started.
+    def draw_carve(self, context):
+        time_start = time.perf_counter()
+        props = context.scene.terrain_sculpt_mesh_brush_props
+        carve_width = props.carve_width
+        world_shape_type = props.world_shape_type
+        if len(self.stroke_trail) < 2 or carve_width <= 0:
+            return
+
+        terrain_origin = vecZero.copy()
+        if props.terrain_origin != None:
+            terrain_origin = props.terrain_origin.matrix_world.translation
+        origin = np.array(terrain_origin)
+
+        path = np.array([p.to_tuple() for p in self.stroke_trail])
+        if world_shape_type == 'FLAT':
+            path_heights = path[:, 2] - origin[2]
+        else:
+            path_heights = np.linalg.norm(path - origin, axis = 1)
+        ground_radius = path_heights.mean()
+
+        #Distances to the path are measured along the ground, ignoring height
+        def flatten(world):
+            if world_shape_type == 'FLAT':
+                return world * (1, 1, 0)
+            offset = world - origin
+            return offset * (ground_radius / np.maximum(np.linalg.norm(offset, axis = 1), 1e-12))[:, np.newaxis]
+
+        segment_index = SegmentIndex(flatten(path), carve_width)
+
+        def select(world):
+            distance, segment, param = segment_index.nearest(flatten(world))
+            return np.nonzero(distance < carve_width)[0]
+
+        found = set()
+        for p in self.stroke_trail:
+            offset_from_origin, down = self.calc_offset_from_origin(p, terrain_origin, world_shape_type)
+            found.update(self.tile_index.query(p, down, carve_width * (1 + carve_point_spacing)))
+        brush_objects = [obj for obj in self.tile_index.objects if obj in found]
+
+        offset_from_origin, down = self.calc_offset_from_origin(self.stroke_trail[0], terrain_origin, world_shape_type)
+        region = BrushRegion(brush_objects, path[0], -down, carve_width, 0, terrain_origin, world_shape_type, select, self.vertex_cache)
+        vert_count = 0
+        if len(region) > 0:
+            distance, segment, param = segment_index.nearest(flatten(region.world))
+            bed = carve_bed_heights(path_heights, props.carve_depth)
+            bed = bed[segment] * (1 - param) + bed[segment + 1] * param
+            cut = carve_profile(distance / carve_width, props.carve_profile) * props.strength
+            if self.brush_mask.is_active():
+                cut *= region.mask_weights(self.brush_mask)
+            heights = region.height + (np.minimum(region.height, bed) - region.height) * cut
+            vert_count, commit_time = self.commit_region(region, heights)
+
+        perf_metrics.record('carve', time.perf_counter() - time_start, region.verts_scanned, vert_count, len(self.tile_index), len(self.tile_index) - len(brush_objects))
+        self.request_redraw()
 
     def draw_ramp(self, context, event):
+        time_start = time.perf_counter()
+        verts_scanned = 0
+        vert_count = 0
         mouse_pos = (event.mouse_region_x, event.mouse_region_y)
         region = context.region
         rv3d = context.region_data
@@ -706,13 +1048,7 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
         w2l = l2w.inverted()
 
         
-        for obj in context.scene.objects:
-            if not obj.select_get():
-                continue
-
-            if obj.type != 'MESH':
-                continue
-            
+        for obj in self.tile_index.objects:
             l2w = obj.matrix_world
             w2l = l2w.inverted()
             
@@ -724,6 +1060,11 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
                 bm.from_mesh(mesh)
         
             
+            changed_indices = []
+            before_coords = []
+            changed_coords = []
+            mask = self.brush_mask.get(obj)
+            verts_scanned += len(bm.verts)
             for v in bm.verts:
                 wpos = l2w @ v.co
                 
@@ -761,19 +1102,31 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
                             
                     s = closest_point_to_line(wpos, down, ramp_start, ramp_span)
                     clamped_to_ramp = wpos + down * s
-                    newWpos = lerp(wpos, clamped_to_ramp, strength_ramp * attenParallel * attenPerp)
+                    atten = strength_ramp * attenParallel * attenPerp
+                    if mask is not None:
+                        atten *= mask[v.index]
+                    newWpos = lerp(wpos, clamped_to_ramp, atten)
                 
+                    changed_indices.append(v.index)
+                    before_coords.append(v.co[:])
                     v.co = w2l @ newWpos
+                    changed_coords.append(v.co[:])
                 
+            self.record_moved(obj, changed_indices, before_coords, changed_coords)
+            vert_count += len(changed_indices)
 
-            if obj.mode == 'EDIT':
-                bmesh.update_edit_mesh(mesh)
-            elif obj.mode == 'OBJECT':
-                bm.to_mesh(mesh)
-                bm.free()
+            with PerfTimer('commit', verts_modified = len(changed_indices), objects_total = 1):
+                if obj.mode == 'EDIT':
+                    bmesh.update_edit_mesh(mesh)
+                elif obj.mode == 'OBJECT':
+                    bm.to_mesh(mesh)
+                    bm.free()
                 
             #mesh.calc_normals_split()
 
+        perf_metrics.record('ramp', time.perf_counter() - time_start, verts_scanned, vert_count, len(self.tile_index))
+        self.request_redraw()
+
 
                     
     def mouse_move(self, context, event):
@@ -834,12 +1187,15 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
             if result == False or object.select_get() == False or object.type != 'MESH':
                 return {'RUNNING_MODAL'}
                             
+            self.check_selection(context)
             self.dragging = True
+            perf_metrics.begin_stroke()
             self.stroke_trail = []
             self.start_location = location.copy()
 
             props = context.scene.terrain_sculpt_mesh_brush_props
             brush_type = props.brush_type
+            self.brush_mask.update(self.tile_index.objects, props.mask_type, props.mask_name, props.mask_invert)
     
             if brush_type == 'DRAW' and event.ctrl:
                 context.window.cursor_set("EYEDROPPER")
@@ -848,6 +1204,8 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
 
             context.window.cursor_set("DEFAULT")
         
+            if self.profiler != None:
+                self.profiler.begin_stroke()
             self.dab_brush(context, event, start_stroke = True)
 
             
@@ -858,12 +1216,18 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
             
             if brush_type == 'RAMP':
                 self.draw_ramp(context, event)
+            elif brush_type == 'CARVE':
+                self.end_carve_path(context, event)
+                self.draw_carve(context)
         
         
             self.dragging = False
 #            self.edit_object = None
             
             self.history_snapshot(context)
+            if self.profiler != None and self.profiler.end_stroke():
+                self.save_profile(context)
+            self.check_memory(context)
             context.window.cursor_set("DEFAULT")
 
 
@@ -872,10 +1236,42 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
     @classmethod
     def poll(cls, context):
         return context.active_object is not None
+
+    def cancel(self, context):
+        self.abort_session()
         
     def modal(self, context, event):
+        if event.type == 'TIMER':
+            if event.timer != self._timer:
+                return {'PASS_THROUGH'}
+            #Follow the view while it is being navigated
+            if self.view_dirty:
+                self.update_view()
+                self.update_cursor_geometry(context)
+            
+            self.check_state(context)
+            self.flush_redraw()
+            return {'RUNNING_MODAL'}
+
+        if self.view_dirty:
+            self.update_view()
+        if event.type != 'MOUSEMOVE':
+            self.check_state(context)
+
+        try:
+            result = self.handle_event(context, event)
+        except BaseException:
+            self.abort_session()
+            raise
+        if result == {'PASS_THROUGH'}:
+            self.view_dirty = True
+        if result != {'FINISHED'} and result != {'CANCELLED'}:
+            self.update_cursor_geometry(context)
+            self.flush_redraw()
+        return result
+
+    def handle_event(self, context, event):
 #        print("modal evTyp:%s evVal:%s" % (str(event.type), str(event.value)))
-        context.area.tag_redraw()
         
         
         # window_result = self.window.handle_event(context, event)
@@ -918,7 +1314,13 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
             if event.value == 'RELEASE':
                 bpy.types.SpaceView3D.draw_handler_remove(self._handle, 'WINDOW')
                 bpy.types.SpaceView3D.draw_handler_remove(self._handle_viewport, 'WINDOW')
+                self.remove_timer()
+                self.area.tag_redraw()
+                if self.profiler != None:
+                    self.save_profile(context)
+                self.unregister_memory_providers()
                 self.history_clear(context)
+                self.journal = None
                 bpy.context.window.cursor_set("DEFAULT")
                 return {'FINISHED'}
             return {'RUNNING_MODAL'}
@@ -999,13 +1401,49 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
             if event.value == "PRESS":
                 context.scene.terrain_sculpt_mesh_brush_props.brush_type = 'RAMP'
             return {'RUNNING_MODAL'}
+
+        elif event.type in {'E'}:
+            if event.value == "PRESS":
+                context.scene.terrain_sculpt_mesh_brush_props.brush_type = 'EROSION'
+            return {'RUNNING_MODAL'}
+
+        elif event.type in {'T'}:
+            if event.value == "PRESS":
+                context.scene.terrain_sculpt_mesh_brush_props.brush_type = 'THERMAL'
+            return {'RUNNING_MODAL'}
+
+        elif event.type in {'N'}:
+            if event.value == "PRESS":
+                context.scene.terrain_sculpt_mesh_brush_props.brush_type = 'NOISE'
+            return {'RUNNING_MODAL'}
+
+        elif event.type in {'I'}:
+            if event.value == "PRESS":
+                context.scene.terrain_sculpt_mesh_brush_props.brush_type = 'STAMP'
+            return {'RUNNING_MODAL'}
+
+        elif event.type in {'Q'}:
+            if event.value == "PRESS":
+                context.scene.terrain_sculpt_mesh_brush_props.brush_type = 'TERRACE'
+            return {'RUNNING_MODAL'}
+
+        elif event.type in {'C'}:
+            if event.value == "PRESS":
+                context.scene.terrain_sculpt_mesh_brush_props.brush_type = 'CARVE'
+            return {'RUNNING_MODAL'}
             
         elif event.type == 'ESC':
             if event.value == 'RELEASE':
                 bpy.types.SpaceView3D.draw_handler_remove(self._handle, 'WINDOW')
                 bpy.types.SpaceView3D.draw_handler_remove(self._handle_viewport, 'WINDOW')
+                self.remove_timer()
+                self.area.tag_redraw()
+                if self.profiler != None:
+                    self.save_profile(context)
+                self.unregister_memory_providers()
                 self.history_restore_bookmark(context, 0)
                 self.history_clear(context)            
+                self.journal = None
                 bpy.context.window.cursor_set("DEFAULT")
                 return {'CANCELLED'}
             return {'RUNNING_MODAL'}
@@ -1018,6 +1456,10 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
 
     def invoke(self, context, event):
         if context.area.type == 'VIEW_3D':
+            props = context.scene.terrain_sculpt_mesh_brush_props
+            if props.use_journal and has_unrecovered_journal():
+                self.report({'WARNING'}, "Found a sculpt journal from an earlier session.  Recover or discard it before sculpting.")
+                return {'CANCELLED'}
     #        print("invoke evTyp:%s evVal:%s" % (str(event.type), str(event.value)))
 
             args = (self, context)
@@ -1026,11 +1468,35 @@ class TerrainSculptMeshOperator(bpy.types.Operator):
 
             bpy.context.window.cursor_set("PAINT_BRUSH")
 
+            self.area = context.area
+            self.region = context.region
+            self.rv3d = context.region_data
+            self.update_view()
+            self.window = context.window
+
             redraw_all_viewports(context)
+            self.tile_index = TileIndex(context.selected_objects)
+            self.height_field = HeightField(self.tile_index.objects)
+            self.edge_cache = EdgeCache()
+            self.vertex_cache = VertexCache()
+            self.brush_mask = BrushMask()
+            self.brush_mask.update(self.tile_index.objects, props.mask_type, props.mask_name, props.mask_invert)
+            clear_stamp_pyramids()
+            self.register_memory_providers()
+            self.history.budget_bytes = props.history_memory_budget * 1024 * 1024
+            self.history.disk_budget_bytes = props.history_disk_budget * 1024 * 1024
             self.history_clear(context)
-            self.history_snapshot(context)
             self.history_snapshot(context, 0)
 
+            if props.profile_strokes:
+                self.profiler = StrokeProfiler(props.profile_stroke_count)
+
+            self.journal = None
+            if props.use_journal:
+                self.journal = open_sculpt_journal()
+                self.journal.begin_session()
+                self.check_journal()
+
             context.window_manager.modal_handler_add(self)
             context.area.tag_redraw()
             
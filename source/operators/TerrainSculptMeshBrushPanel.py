@@ -30,6 +30,12 @@ from .TerrainSculptMeshProperties import *
 from .TerrainSculptMeshBrush import *
 from .TerrainHeightPickerMeshOperator import *
 from .TerrainSculptWorkspaceTool import *
+from .TerrainTileMeshOperator import *
+from .TerrainJournalOperator import *
+from .TerrainPerfMetricsOperator import *
+from .TerrainTerraceOperator import *
+from .MemoryAccounting import *
+from .NoiseTiles import *
 
  
 #---------------------------
@@ -82,9 +88,46 @@ class TerrainSculptMeshBrushPanel(bpy.types.Panel):
             col.prop(props, "strength")
         col.prop(props, "use_pressure")
         col.prop(props, "terrain_origin")
+        col.prop(props, "history_memory_budget")
+        col.prop(props, "history_disk_budget")
+        col.prop(props, "use_journal")
+        if has_unrecovered_journal():
+            row = col.row(align = True)
+            row.operator("kitfox.terrain_recover_journal", text="Recover Journal")
+            row.operator("kitfox.terrain_discard_journal", text="Discard Journal")
+        col.prop(props, "show_perf_hud")
+        col.operator("kitfox.terrain_export_perf_metrics", text="Export Brush Metrics")
+        row = col.row(align = True)
+        row.prop(props, "profile_strokes")
+        row.prop(props, "profile_stroke_count")
+
+        col.label(text="Memory:")
+        col.prop(props, "memory_ceiling")
+        report = cached_memory_report()
+        box = col.box()
+        total = memory_total(report)
+        if is_memory_near_ceiling(total, props.memory_ceiling * 1024 * 1024):
+            box.label(text="Total %s, near ceiling" % format_bytes(total), icon = 'ERROR')
+        else:
+            box.label(text="Total %s" % format_bytes(total))
+        for name, usage in report.items():
+            box.label(text="%s: %s" % (name, format_bytes(sum(usage.values()))))
+            for key in sorted(usage, key = usage.get, reverse = True)[:memory_panel_rows]:
+                box.label(text="    %s: %s" % (key, format_bytes(usage[key])))
         col.label(text="Brush Type:")
         col.prop(props, "brush_type", expand = True, text = "Brush Type")
         col.prop(props, "world_shape_type", text = "Land Shape")
+
+        col.prop(props, "mask_type", text = "Mask")
+        if props.mask_type != 'NONE':
+            obj = context.object
+            if props.mask_type == 'VERTEX_GROUP' and obj.type == 'MESH':
+                col.prop_search(props, "mask_name", obj, "vertex_groups")
+            elif props.mask_type == 'COLOR_ATTRIBUTE' and obj.type == 'MESH':
+                col.prop_search(props, "mask_name", obj.data, "color_attributes")
+            else:
+                col.prop(props, "mask_name")
+            col.prop(props, "mask_invert")
         
         if props.brush_type == 'DRAW':
             col.prop(props, "draw_height")
@@ -105,6 +148,49 @@ class TerrainSculptMeshBrushPanel(bpy.types.Panel):
             col.prop(props, "ramp_width")
             col.prop(props, "ramp_falloff")
 
+        if props.brush_type == 'EROSION':
+            col.prop(props, "erosion_iterations")
+            col.prop(props, "erosion_rain")
+            col.prop(props, "erosion_solubility")
+            col.prop(props, "erosion_deposition")
+            col.prop(props, "erosion_capacity")
+            col.prop(props, "erosion_evaporation")
+
+        if props.brush_type == 'THERMAL':
+            col.prop(props, "talus_angle")
+            col.prop(props, "thermal_iterations")
+            col.prop(props, "thermal_rate")
+
+        if props.brush_type == 'NOISE':
+            col.prop(props, "noise_type", expand = True)
+            col.prop(props, "noise_scale")
+            col.prop(props, "noise_amount")
+            col.prop(props, "noise_octaves")
+            col.prop(props, "noise_seed")
+
+        if props.brush_type == 'STAMP':
+            col.prop(props, "stamp_image")
+            col.prop(props, "stamp_height")
+            col.prop(props, "stamp_rotation")
+
+        if props.brush_type == 'TERRACE':
+            col.prop(props, "terrace_step")
+            col.prop(props, "terrace_sharpness")
+            col.prop(props, "terrace_offset")
+            col.operator("kitfox.terrain_terrace", text="Terrace Selected")
+
+        if props.brush_type == 'CARVE':
+            col.prop(props, "carve_width")
+            col.prop(props, "carve_depth")
+            col.prop(props, "carve_profile", expand = True)
+
+        col.label(text="Tiles:")
+        row = col.row(align = True)
+        row.prop(props, "tile_count_x")
+        row.prop(props, "tile_count_y")
+        col.operator("kitfox.terrain_split_tiles", text="Split Into Tiles")
+        col.operator("kitfox.terrain_merge_tiles", text="Merge Tiles")
+
 #---------------------------
 
 
@@ -115,7 +201,19 @@ def register():
     bpy.utils.register_class(TerrainSculptMeshProperties)
     bpy.utils.register_class(TerrainSculptMeshOperator)
     bpy.utils.register_class(TerrainHeightPickerMeshOperator)
+    bpy.utils.register_class(TerrainSplitTilesOperator)
+    bpy.utils.register_class(TerrainMergeTilesOperator)
+    bpy.utils.register_class(TerrainRecoverJournalOperator)
+    bpy.utils.register_class(TerrainDiscardJournalOperator)
+    bpy.utils.register_class(TerrainExportPerfMetricsOperator)
+    bpy.utils.register_class(TerrainTerraceOperator)
     bpy.utils.register_class(TerrainSculptMeshBrushPanel)
+    register_journal_handlers()
+    register_memory_provider("Brush Metrics", get_perf_metrics().memory_usage)
+    register_memory_provider("Crash Journal", journal_memory_usage)
+    register_memory_provider("Noise Tiles", noise_tiles_memory_usage)
+    register_memory_provider("Stamp Images", stamp_memory_usage)
+    start_memory_tracing()
 
 #    bpy.utils.register_class(EchoToolOperator)    
 #    bpy.utils.register_tool(TerrainSculptWorkspaceTool, after={"builtin.scale_cage"}, separator=True, group=True)
@@ -126,7 +224,21 @@ def unregister():
     bpy.utils.unregister_class(TerrainSculptMeshProperties)
     bpy.utils.unregister_class(TerrainSculptMeshOperator)
     bpy.utils.unregister_class(TerrainHeightPickerMeshOperator)
+    bpy.utils.unregister_class(TerrainSplitTilesOperator)
+    bpy.utils.unregister_class(TerrainMergeTilesOperator)
+    bpy.utils.unregister_class(TerrainRecoverJournalOperator)
+    bpy.utils.unregister_class(TerrainDiscardJournalOperator)
+    bpy.utils.unregister_class(TerrainExportPerfMetricsOperator)
+    bpy.utils.unregister_class(TerrainTerraceOperator)
     bpy.utils.unregister_class(TerrainSculptMeshBrushPanel)
+    unregister_journal_handlers()
+    unregister_memory_provider("Brush Metrics")
+    unregister_memory_provider("Crash Journal")
+    unregister_memory_provider("Noise Tiles")
+    clear_noise_tiles()
+    unregister_memory_provider("Stamp Images")
+    clear_stamp_pyramids()
+    stop_memory_tracing()
 
 #    bpy.utils.unregister_class(EchoToolOperator)
 #    bpy.utils.unregister_tool(TerrainSculptWorkspaceTool)
@@ -95,6 +95,12 @@ class TerrainSculptMeshProperties(bpy.types.PropertyGroup):
             ('SLOPE', "Slope (P)", "Use the slope of the surface under the brush to set height."),
             ('SMOOTH', "Smooth (M)", "Average out the terrain under the brush."),
             ('RAMP', "Ramp (R)", "Draw a ramp between where you press and release the mouse."),
+            ('EROSION', "Erosion (E)", "Run a hydraulic erosion simulation on the terrain under the brush."),
+            ('THERMAL', "Thermal (T)", "Crumble slopes steeper than the talus angle until they settle."),
+            ('NOISE', "Noise (N)", "Roughen the terrain with fractal noise."),
+            ('STAMP', "Stamp (I)", "Raise the terrain by the brightness of an image."),
+            ('TERRACE', "Terrace (Q)", "Snap the terrain onto a series of flat steps."),
+            ('CARVE', "Carve (C)", "Cut a downhill channel along the path of the stroke when the mouse is released."),
         ),
         default='DRAW'
     )
@@ -161,6 +167,274 @@ class TerrainSculptMeshProperties(bpy.types.PropertyGroup):
         max = 1
     )
 
+    erosion_iterations : bpy.props.IntProperty(
+        name = "Erosion Iterations", 
+        description = "Number of simulation steps run for each dab of the erosion brush.", 
+        default = 30, 
+        min = 1, 
+        soft_max = 200
+    )
+
+    erosion_rain : bpy.props.FloatProperty(
+        name = "Rain", 
+        description = "Water added to the terrain each step as a fraction of the simulation cell size.", 
+        default = .01, 
+        min = 0, 
+        soft_max = .1
+    )
+
+    erosion_solubility : bpy.props.FloatProperty(
+        name = "Solubility", 
+        description = "How quickly flowing water picks up soil.", 
+        default = .3, 
+        min = 0, 
+        max = 1
+    )
+
+    erosion_deposition : bpy.props.FloatProperty(
+        name = "Deposition", 
+        description = "How quickly water drops soil it cannot carry.", 
+        default = .3, 
+        min = 0, 
+        max = 1
+    )
+
+    erosion_capacity : bpy.props.FloatProperty(
+        name = "Sediment Capacity", 
+        description = "Amount of soil fast moving water can carry.  Higher values cut deeper channels.", 
+        default = 4, 
+        min = 0, 
+        soft_max = 20
+    )
+
+    erosion_evaporation : bpy.props.FloatProperty(
+        name = "Evaporation", 
+        description = "Fraction of water that evaporates each step.", 
+        default = .05, 
+        min = 0, 
+        max = 1
+    )
+
+    talus_angle : bpy.props.FloatProperty(
+        name = "Talus Angle", 
+        description = "Steepest slope in degrees that the thermal brush leaves standing.", 
+        default = 35, 
+        min = 0, 
+        max = 89
+    )
+
+    thermal_iterations : bpy.props.IntProperty(
+        name = "Thermal Iterations", 
+        description = "Largest number of relaxation steps run for each dab of the thermal brush.  Stops early once the slopes settle.", 
+        default = 50, 
+        min = 1, 
+        soft_max = 500
+    )
+
+    thermal_rate : bpy.props.FloatProperty(
+        name = "Crumble Rate", 
+        description = "Fraction of the excess slope moved downhill in each step.", 
+        default = .5, 
+        min = 0, 
+        max = 1
+    )
+
+    noise_type : bpy.props.EnumProperty(
+        items=(
+            ('FBM', "fBm", "Rolling noise made of several octaves of smooth bumps."),
+            ('RIDGED', "Ridged", "Noise with sharp crests like mountain ridges."),
+        ),
+        default='FBM'
+    )
+
+    noise_scale : bpy.props.FloatProperty(
+        name = "Noise Scale", 
+        description = "Size of the largest bumps made by the noise brush.", 
+        default = 1, 
+        min = .001, 
+        soft_max = 100
+    )
+
+    noise_amount : bpy.props.FloatProperty(
+        name = "Noise Amount", 
+        description = "Height of the bumps added by each dab of the noise brush.", 
+        default = .1, 
+        min = 0, 
+        soft_max = 10
+    )
+
+    noise_octaves : bpy.props.IntProperty(
+        name = "Noise Octaves", 
+        description = "Number of layers of ever finer detail in the noise.", 
+        default = 4, 
+        min = 1, 
+        max = 12
+    )
+
+    noise_seed : bpy.props.IntProperty(
+        name = "Noise Seed", 
+        description = "Pick a different noise pattern.", 
+        default = 0, 
+        min = 0
+    )
+
+    stamp_image : bpy.props.PointerProperty(
+        name = "Stamp Image", 
+        description = "Grayscale heightmap pressed into the terrain by the stamp brush.  White is raised the most.", 
+        type = bpy.types.Image
+    )
+
+    stamp_height : bpy.props.FloatProperty(
+        name = "Stamp Height", 
+        description = "Height a white pixel raises the terrain by with each dab.  Use a negative value to press the image in.", 
+        default = .5, 
+        soft_min = -10, 
+        soft_max = 10
+    )
+
+    stamp_rotation : bpy.props.FloatProperty(
+        name = "Stamp Rotation", 
+        description = "Rotation of the image around the center of the brush.", 
+        default = 0, 
+        subtype = 'ANGLE'
+    )
+
+    terrace_step : bpy.props.FloatProperty(
+        name = "Terrace Step", 
+        description = "Height between neighbouring terraces.", 
+        default = 1, 
+        min = 0, 
+        soft_max = 100
+    )
+
+    terrace_sharpness : bpy.props.FloatProperty(
+        name = "Terrace Sharpness", 
+        description = "Fraction of each step that is flat.  At 1 the terraces are joined by vertical cliffs.", 
+        default = .8, 
+        min = 0, 
+        max = 1
+    )
+
+    terrace_offset : bpy.props.FloatProperty(
+        name = "Terrace Offset", 
+        description = "Height above the origin of the first terrace.", 
+        default = 0, 
+        soft_min = -100, 
+        soft_max = 100
+    )
+
+    carve_width : bpy.props.FloatProperty(
+        name = "Channel Width", 
+        description = "Distance from the center of the channel to its banks.", 
+        default = 1, 
+        min = 0, 
+        soft_max = 10
+    )
+
+    carve_depth : bpy.props.FloatProperty(
+        name = "Channel Depth", 
+        description = "Depth of the channel bed below the lowest ground the stroke has crossed.", 
+        default = .5, 
+        min = 0, 
+        soft_max = 10
+    )
+
+    carve_profile : bpy.props.EnumProperty(
+        items=(
+            ('V', "V", "Banks slope evenly down to the center."),
+            ('U', "U", "Rounded channel."),
+            ('BOX', "Box", "Flat bed with steep banks."),
+        ),
+        default='U'
+    )
+
+    mask_type : bpy.props.EnumProperty(
+        items=(
+            ('NONE', "None", "Brushes affect every vertex under them."),
+            ('VERTEX_GROUP', "Vertex Group", "Scale brush strength by the weight of each vertex in a vertex group."),
+            ('COLOR_ATTRIBUTE', "Color Attribute", "Scale brush strength by the brightness of a color attribute."),
+        ),
+        default='NONE'
+    )
+
+    mask_name : bpy.props.StringProperty(
+        name = "Mask", 
+        description = "Name of the vertex group or color attribute used as a mask.  Meshes without it are not masked.", 
+        default = ""
+    )
+
+    mask_invert : bpy.props.BoolProperty(
+        name = "Invert Mask", 
+        description = "Protect the masked areas instead of the unmasked ones.", 
+        default = False
+    )
+
+    history_memory_budget : bpy.props.FloatProperty(
+        name = "Undo Memory (MB)", 
+        description = "Maximum memory the brush undo history may use, not counting the copy of the meshes kept to cancel the brush.  The oldest strokes are moved to disk when this is exceeded.", 
+        default = 256, 
+        min = 1, 
+        soft_max = 4096
+    )
+
+    history_disk_budget : bpy.props.FloatProperty(
+        name = "Undo Disk (MB)", 
+        description = "Maximum temporary disk space older undo steps may use once they no longer fit in Undo Memory.", 
+        default = 2048, 
+        min = 0, 
+        soft_max = 65536
+    )
+
+    use_journal : bpy.props.BoolProperty(
+        name = "Crash Journal", 
+        description = "Write strokes to a journal file next to the blend file so they can be recovered if Blender crashes before the file is saved.", 
+        default = True
+    )
+
+    show_perf_hud : bpy.props.BoolProperty(
+        name = "Performance HUD", 
+        description = "Show dab timings, dab rate and undo memory in the corner of the viewport while the brush is active.", 
+        default = False
+    )
+
+    profile_strokes : bpy.props.BoolProperty(
+        name = "Profile Strokes", 
+        description = "Run the Python profiler over the next strokes of the brush and save the results next to the blend file.  Turns itself off once the strokes are saved.", 
+        default = False
+    )
+
+    profile_stroke_count : bpy.props.IntProperty(
+        name = "Strokes", 
+        description = "Number of strokes to profile.", 
+        default = 3, 
+        min = 1, 
+        soft_max = 20
+    )
+
+    memory_ceiling : bpy.props.FloatProperty(
+        name = "Memory Ceiling (MB)", 
+        description = "Memory the brush caches, indexes and undo history may use before you are warned.  The warning appears at 90% of this value.", 
+        default = 2048, 
+        min = 0, 
+        soft_max = 32768
+    )
+
+    tile_count_x : bpy.props.IntProperty(
+        name = "Tiles X", 
+        description = "Number of tiles along the X axis when splitting a terrain into tiles.", 
+        default = 4, 
+        min = 1, 
+        soft_max = 32
+    )
+
+    tile_count_y : bpy.props.IntProperty(
+        name = "Tiles Y", 
+        description = "Number of tiles along the Y axis when splitting a terrain into tiles.", 
+        default = 4, 
+        min = 1, 
+        soft_max = 32
+    )
+
 
 
 # def register():
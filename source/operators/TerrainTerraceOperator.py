@@ -0,0 +1,49 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import bpy
+from ..kitfox.math.vecmath import *
+from .TerrainSculptMeshProperties import *
+from .Terrace import *
+
+class TerrainTerraceOperator(bpy.types.Operator):
+    """Terrace every vertex of the selected terrain meshes using the terrace brush settings"""
+    bl_idname = "kitfox.terrain_terrace"
+    bl_label = "Terrace Terrain"
+    bl_options = {"REGISTER", "UNDO"}
+
+    @classmethod
+    def poll(cls, context):
+        return any(obj.type == 'MESH' for obj in context.selected_objects) and context.mode == 'OBJECT'
+
+    def execute(self, context):
+        props = context.scene.terrain_sculpt_mesh_brush_props
+        if props.terrace_step <= 0:
+            self.report({'WARNING'}, "Terrace step must be greater than zero")
+            return {'CANCELLED'}
+
+        terrain_origin = vecZero.copy()
+        if props.terrain_origin != None:
+            terrain_origin = props.terrain_origin.matrix_world.translation
+
+        count = 0
+        for obj in context.selected_objects:
+            if obj.type != 'MESH':
+                continue
+            if terrace_object(obj, props.terrace_step, props.terrace_sharpness, props.terrace_offset, terrain_origin, props.world_shape_type):
+                count += 1
+
+        self.report({'INFO'}, "Terraced %d objects" % count)
+        return {'FINISHED'}
@@ -0,0 +1,366 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import bpy
+import mathutils
+import math
+import numpy as np
+from ..kitfox.math.vecmath import *
+from .TerrainSculptMeshProperties import *
+
+#Name of integer point attribute that remembers which vertex of the original
+# mesh a tile vertex came from.  Used to weld seams exactly when merging.
+tile_source_index_attr = "terrain_tile_src_index"
+
+#foreach_get key, number of components and numpy type for each attribute data type
+attribute_value_info = {
+    'FLOAT': ('value', 1, np.float32),
+    'INT': ('value', 1, np.int32),
+    'INT8': ('value', 1, np.int8),
+    'BOOLEAN': ('value', 1, bool),
+    'FLOAT2': ('vector', 2, np.float32),
+    'INT32_2D': ('value', 2, np.int32),
+    'FLOAT_VECTOR': ('vector', 3, np.float32),
+    'FLOAT_COLOR': ('color', 4, np.float32),
+    'BYTE_COLOR': ('color', 4, np.float32),
+    'QUATERNION': ('value', 4, np.float32),
+    'FLOAT4X4': ('value', 16, np.float32),
+}
+
+#--------------------------------------
+
+#Reads the topology of a mesh into flat numpy arrays
+class MeshArrays:
+    def __init__(self, mesh):
+        num_verts = len(mesh.vertices)
+        num_edges = len(mesh.edges)
+        num_loops = len(mesh.loops)
+        num_faces = len(mesh.polygons)
+
+        self.co = np.empty(num_verts * 3, dtype = np.float32)
+        mesh.vertices.foreach_get("co", self.co)
+        self.co = self.co.reshape((-1, 3))
+
+        self.edge_verts = np.empty(num_edges * 2, dtype = np.int32)
+        mesh.edges.foreach_get("vertices", self.edge_verts)
+        self.edge_verts = self.edge_verts.reshape((-1, 2))
+
+        self.loop_vert = np.empty(num_loops, dtype = np.int32)
+        mesh.loops.foreach_get("vertex_index", self.loop_vert)
+        self.loop_edge = np.empty(num_loops, dtype = np.int32)
+        mesh.loops.foreach_get("edge_index", self.loop_edge)
+
+        self.face_start = np.empty(num_faces, dtype = np.int32)
+        mesh.polygons.foreach_get("loop_start", self.face_start)
+        self.face_total = np.empty(num_faces, dtype = np.int32)
+        mesh.polygons.foreach_get("loop_total", self.face_total)
+
+        self.attributes = read_attributes(mesh)
+
+    #Indices of the loops of the given faces, in face order
+    def face_loops(self, faces):
+        totals = self.face_total[faces]
+        offsets = np.cumsum(totals) - totals
+        return np.arange(totals.sum()) + np.repeat(self.face_start[faces] - offsets, totals)
+
+#Returns list of (name, domain, data_type, values) for the attributes that can be copied
+def read_attributes(mesh):
+    result = []
+    for attr in mesh.attributes:
+        if attr.name.startswith("."):
+            continue
+        if attr.data_type not in attribute_value_info:
+            continue
+
+        key, comps, dtype = attribute_value_info[attr.data_type]
+        values = np.empty(len(attr.data) * comps, dtype = dtype)
+        attr.data.foreach_get(key, values)
+        result.append((attr.name, attr.domain, attr.data_type, values.reshape((len(attr.data), comps))))
+    return result
+
+def write_attribute(mesh, name, domain, data_type, values):
+    attr = mesh.attributes.get(name)
+    if attr is None:
+        attr = mesh.attributes.new(name, data_type, domain)
+    elif attr.domain != domain or attr.data_type != data_type:
+        return
+
+    key, comps, dtype = attribute_value_info[data_type]
+    attr.data.foreach_set(key, np.ascontiguousarray(values, dtype = dtype).ravel())
+
+#Create a new mesh from flat arrays.  Face loops must be stored contiguously in face order.
+def build_mesh(name, edge_verts, loop_vert, loop_edge, face_totals, attributes, num_verts):
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(num_verts)
+    mesh.edges.add(len(edge_verts))
+    mesh.loops.add(len(loop_vert))
+    mesh.polygons.add(len(face_totals))
+
+    mesh.edges.foreach_set("vertices", np.ascontiguousarray(edge_verts, dtype = np.int32).ravel())
+    mesh.loops.foreach_set("vertex_index", np.ascontiguousarray(loop_vert, dtype = np.int32))
+    mesh.loops.foreach_set("edge_index", np.ascontiguousarray(loop_edge, dtype = np.int32))
+    mesh.polygons.foreach_set("loop_start", (np.cumsum(face_totals) - face_totals).astype(np.int32))
+
+    #Position is one of the point attributes
+    for attr_name, domain, data_type, values in attributes:
+        write_attribute(mesh, attr_name, domain, data_type, values)
+
+    mesh.update()
+    return mesh
+
+def copy_mesh_settings(src_mesh, mesh):
+    for mat in src_mesh.materials:
+        mesh.materials.append(mat)
+
+    if src_mesh.uv_layers.active != None and src_mesh.uv_layers.active.name in mesh.uv_layers:
+        mesh.uv_layers.active = mesh.uv_layers[src_mesh.uv_layers.active.name]
+
+def link_like(obj, src_obj):
+    for coll in src_obj.users_collection:
+        coll.objects.link(obj)
+    obj.matrix_world = src_obj.matrix_world.copy()
+
+#--------------------------------------
+
+#Splits mesh of obj into count_x by count_y tile objects.  Faces are assigned to
+# tiles by their centroid.  Vertices on the seams are duplicated with identical
+# coordinates so that neighbouring tiles line up exactly.
+def split_mesh_into_tiles(obj, count_x, count_y):
+    src = obj.data
+    arr = MeshArrays(src)
+    num_verts = len(arr.co)
+    num_faces = len(arr.face_start)
+    num_tiles = count_x * count_y
+
+    if num_verts == 0:
+        return []
+
+    lo = arr.co[:, :2].min(axis = 0)
+    hi = arr.co[:, :2].max(axis = 0)
+    span = np.maximum(hi - lo, 1e-12)
+    counts = np.array((count_x, count_y))
+
+    def cell_of(points):
+        c = np.floor((points[:, :2] - lo) / span * counts).astype(np.int64)
+        c = np.clip(c, 0, counts - 1)
+        return c[:, 1] * count_x + c[:, 0]
+
+    #Assign faces by centroid
+    all_loops = arr.face_loops(np.arange(num_faces))
+    if num_faces > 0:
+        offsets = np.cumsum(arr.face_total) - arr.face_total
+        centroids = np.add.reduceat(arr.co[arr.loop_vert[all_loops]], offsets, axis = 0) / arr.face_total[:, np.newaxis]
+        face_cell = cell_of(centroids)
+    else:
+        face_cell = np.zeros(0, dtype = np.int64)
+
+    face_order = np.argsort(face_cell, kind = 'stable')
+    face_bounds = np.concatenate(([0], np.cumsum(np.bincount(face_cell, minlength = num_tiles))))
+
+    #Loose edges and vertices are assigned by position
+    edge_loose = np.ones(len(arr.edge_verts), dtype = bool)
+    edge_loose[arr.loop_edge] = False
+    loose_edges = np.flatnonzero(edge_loose)
+    loose_edge_cell = cell_of((arr.co[arr.edge_verts[loose_edges, 0]] + arr.co[arr.edge_verts[loose_edges, 1]]) / 2)
+
+    vert_loose = np.ones(num_verts, dtype = bool)
+    vert_loose[arr.edge_verts.ravel()] = False
+    loose_verts = np.flatnonzero(vert_loose)
+    loose_vert_cell = cell_of(arr.co[loose_verts])
+
+    source_index = np.arange(num_verts, dtype = np.int32)[:, np.newaxis]
+    attributes = arr.attributes + [(tile_source_index_attr, 'POINT', 'INT', source_index)]
+
+    tiles = []
+    for t in range(num_tiles):
+        faces = face_order[face_bounds[t]:face_bounds[t + 1]]
+        loops = arr.face_loops(faces)
+        extra_edges = loose_edges[loose_edge_cell == t]
+
+        tile_edges = np.unique(np.concatenate((arr.loop_edge[loops], extra_edges)))
+        tile_verts = np.unique(np.concatenate((arr.edge_verts[tile_edges].ravel(), arr.loop_vert[loops], loose_verts[loose_vert_cell == t])))
+
+        if len(tile_verts) == 0:
+            continue
+
+        domain_index = {'POINT': tile_verts, 'EDGE': tile_edges, 'CORNER': loops, 'FACE': faces}
+        tile_attributes = [(name, domain, data_type, values[domain_index[domain]]) for name, domain, data_type, values in attributes if domain in domain_index]
+
+        name = "%s_%d_%d" % (obj.name, t % count_x, t // count_x)
+        mesh = build_mesh(name,
+            np.searchsorted(tile_verts, arr.edge_verts[tile_edges]),
+            np.searchsorted(tile_verts, arr.loop_vert[loops]),
+            np.searchsorted(tile_edges, arr.loop_edge[loops]),
+            arr.face_total[faces],
+            tile_attributes,
+            len(tile_verts))
+        copy_mesh_settings(src, mesh)
+
+        tile = bpy.data.objects.new(name, mesh)
+        link_like(tile, obj)
+        tiles.append(tile)
+
+    return tiles
+
+#Joins tile objects back into a single mesh in the space of target.  Seam vertices
+# are welded using the source index written by split_mesh_into_tiles(), or by
+# exact position if any tile is missing it.
+def merge_tiles(objs, target):
+    w2l = np.array(target.matrix_world.inverted())
+
+    tile_arrays = [MeshArrays(obj.data) for obj in objs]
+
+    #Only copy attributes every tile has
+    common = None
+    for arr in tile_arrays:
+        keys = {(name, domain, data_type) for name, domain, data_type, values in arr.attributes}
+        common = keys if common is None else common & keys
+
+    use_source_index = (tile_source_index_attr, 'POINT', 'INT') in common
+    common.discard((tile_source_index_attr, 'POINT', 'INT'))
+    common.discard(("position", 'POINT', 'FLOAT_VECTOR'))
+
+    co = []
+    keys = []
+    edge_verts = []
+    loop_vert = []
+    loop_edge = []
+    face_totals = []
+    attr_values = {key: [] for key in common}
+    vert_offset = 0
+    edge_offset = 0
+
+    for obj, arr in zip(objs, tile_arrays):
+        xform = w2l @ np.array(obj.matrix_world)
+        co.append(arr.co @ xform[:3, :3].T + xform[:3, 3])
+
+        if use_source_index:
+            for name, domain, data_type, values in arr.attributes:
+                if name == tile_source_index_attr:
+                    keys.append(values[:, 0])
+
+        edge_verts.append(arr.edge_verts + vert_offset)
+        loops = arr.face_loops(np.arange(len(arr.face_start)))
+        loop_vert.append(arr.loop_vert[loops] + vert_offset)
+        loop_edge.append(arr.loop_edge[loops] + edge_offset)
+        face_totals.append(arr.face_total)
+
+        for name, domain, data_type, values in arr.attributes:
+            key = (name, domain, data_type)
+            if key in attr_values:
+                attr_values[key].append(values[loops] if domain == 'CORNER' else values)
+
+        vert_offset += len(arr.co)
+        edge_offset += len(arr.edge_verts)
+
+    co = np.concatenate(co).astype(np.float32)
+    if use_source_index:
+        keys = np.concatenate(keys)
+    else:
+        keys = co
+
+    #Weld vertices
+    unique_keys, vert_first, vert_map = np.unique(keys, axis = 0, return_index = True, return_inverse = True)
+    vert_map = vert_map.ravel()
+
+    #Weld edges that were duplicated along the seams
+    edge_verts = np.sort(vert_map[np.concatenate(edge_verts)], axis = 1)
+    unique_edges, edge_first, edge_map = np.unique(edge_verts, axis = 0, return_index = True, return_inverse = True)
+    edge_map = edge_map.ravel()
+
+    domain_index = {'POINT': vert_first, 'EDGE': edge_first}
+    attributes = [("position", 'POINT', 'FLOAT_VECTOR', co[vert_first])]
+    for (name, domain, data_type), values in attr_values.items():
+        values = np.concatenate(values)
+        if domain in domain_index:
+            values = values[domain_index[domain]]
+        attributes.append((name, domain, data_type, values))
+
+    mesh = build_mesh(target.name + "_merged",
+        unique_edges,
+        vert_map[np.concatenate(loop_vert)],
+        edge_map[np.concatenate(loop_edge)],
+        np.concatenate(face_totals),
+        attributes,
+        len(vert_first))
+    copy_mesh_settings(target.data, mesh)
+
+    merged = bpy.data.objects.new(target.name + "_merged", mesh)
+    link_like(merged, target)
+    return merged
+
+#--------------------------------------
+
+class TerrainSplitTilesOperator(bpy.types.Operator):
+    """Split the active terrain mesh into a grid of tile objects"""
+    bl_idname = "kitfox.terrain_split_tiles"
+    bl_label = "Split Terrain Into Tiles"
+    bl_options = {"REGISTER", "UNDO"}
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return obj != None and obj.type == 'MESH' and obj.mode == 'OBJECT'
+
+    def execute(self, context):
+        props = context.scene.terrain_sculpt_mesh_brush_props
+        obj = context.active_object
+
+        tiles = split_mesh_into_tiles(obj, props.tile_count_x, props.tile_count_y)
+        if len(tiles) == 0:
+            self.report({'WARNING'}, "Mesh is empty, nothing to split")
+            return {'CANCELLED'}
+
+        obj.hide_set(True)
+        obj.select_set(False)
+        for tile in tiles:
+            tile.select_set(True)
+        context.view_layer.objects.active = tiles[0]
+
+        self.report({'INFO'}, "Split %s into %d tiles" % (obj.name, len(tiles)))
+        return {'FINISHED'}
+
+class TerrainMergeTilesOperator(bpy.types.Operator):
+    """Merge the selected terrain tiles back into a single mesh"""
+    bl_idname = "kitfox.terrain_merge_tiles"
+    bl_label = "Merge Terrain Tiles"
+    bl_options = {"REGISTER", "UNDO"}
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return obj != None and obj.type == 'MESH' and obj.mode == 'OBJECT'
+
+    def execute(self, context):
+        target = context.active_object
+        objs = [obj for obj in context.selected_objects if obj.type == 'MESH']
+        if target not in objs:
+            objs.append(target)
+
+        if len(objs) < 2:
+            self.report({'WARNING'}, "Select at least two tiles to merge")
+            return {'CANCELLED'}
+
+        merged = merge_tiles(objs, target)
+
+        for obj in objs:
+            obj.select_set(False)
+            obj.hide_set(True)
+        merged.select_set(True)
+        context.view_layer.objects.active = merged
+
+        self.report({'INFO'}, "Merged %d tiles into %s" % (len(objs), merged.name))
+        return {'FINISHED'}
+
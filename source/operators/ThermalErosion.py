@@ -0,0 +1,55 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import math
+import numpy as np
+
+#Relaxation stops early once no edge is steeper than the talus angle by more
+# than this fraction of its length
+thermal_tolerance = 1e-4
+
+#Move material down every edge that is steeper than talus_angle (in degrees)
+# until the slopes settle or the iterations run out.  Each step moves rate
+# times half the excess height across each steep edge, divided by the number
+# of steep edges meeting at its ends so that no vertex overshoots.  Material
+# is only moved, so the total height is kept.  height and edges are given in terms of
+# welded vertices, and edge_length is the horizontal length of each edge.
+# Returns the new heights and the number of iterations run.
+def relax_talus(height, edges, edge_length, talus_angle, iterations, rate):
+    h = np.array(height, dtype = np.float64)
+    if len(edges) == 0:
+        return (h, 0)
+
+    a = edges[:, 0]
+    b = edges[:, 1]
+    max_drop = math.tan(math.radians(talus_angle)) * edge_length
+    tolerance = thermal_tolerance * edge_length
+
+    for i in range(iterations):
+        diff = h[a] - h[b]
+        excess = np.abs(diff) - max_drop
+        steep = excess > tolerance
+        if not np.any(steep):
+            return (h, i)
+
+        #Split the move between the steep edges of each vertex
+        a_steep = a[steep]
+        b_steep = b[steep]
+        degree = np.bincount(a_steep, minlength = len(h)) + np.bincount(b_steep, minlength = len(h))
+        amount = rate * .5 * excess[steep] * np.sign(diff[steep]) / np.maximum(degree[a_steep], degree[b_steep])
+        h -= np.bincount(a_steep, weights = amount, minlength = len(h))
+        h += np.bincount(b_steep, weights = amount, minlength = len(h))
+
+    return (h, iterations)
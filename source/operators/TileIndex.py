@@ -0,0 +1,139 @@
+# This file is part of the Kitfox Normal Brush distribution (https://github.com/blackears/terrainSculpt).
+# Copyright (c) 2021 Mark McKay
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import bpy
+import mathutils
+import math
+import numpy as np
+from ..kitfox.math.vecmath import *
+
+
+#Registry of the mesh tiles the brush can draw on.  Keeps the local bounds of
+# each tile plus world space AABBs sorted along the X axis so that the tiles
+# under the brush can be found with one query per dab.
+class TileIndex:
+    def __init__(self, objs):
+        self.objects = [obj for obj in objs if obj.type == 'MESH']
+        self.obj_index = {obj.name: i for i, obj in enumerate(self.objects)}
+
+        self.bounds_min, self.bounds_max, self.xforms = mesh_bounds_fast_batch(self.objects)
+        self.dirty = True
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __contains__(self, obj):
+        return obj.name in self.obj_index
+
+    def __rebuild(self):
+        count = len(self.objects)
+
+        #World AABB of each transformed local box
+        corners = np.empty((count, 8, 3))
+        for i in range(8):
+            corners[:, i, :] = np.where([(i & 1) != 0, (i & 2) != 0, (i & 4) != 0], self.bounds_max, self.bounds_min)
+        corners = np.einsum('nij,nkj->nki', self.xforms[:, :3, :3], corners) + self.xforms[:, np.newaxis, :3, 3]
+
+        self.world_min = corners.min(axis = 1)
+        self.world_max = corners.max(axis = 1)
+
+        self.order = np.argsort(self.world_min[:, 0], kind = 'stable')
+        self.sorted_min_x = self.world_min[self.order, 0]
+        self.max_extent_x = (self.world_max[:, 0] - self.world_min[:, 0]).max() if count > 0 else 0
+
+        if count > 0:
+            self.scene_min = self.world_min.min(axis = 0)
+            self.scene_max = self.world_max.max(axis = 0)
+
+        self.dirty = False
+
+    #Grow the bounds of a tile to include points given in its local space.
+    # Called after a dab moves vertices so that later queries still find the tile.
+    def include_points(self, obj, points):
+        idx = self.obj_index.get(obj.name)
+        if idx is None or len(points) == 0:
+            return
+
+        points = np.asarray(points)
+        lo = points.min(axis = 0)
+        hi = points.max(axis = 0)
+        if np.any(lo < self.bounds_min[idx]) or np.any(hi > self.bounds_max[idx]):
+            self.bounds_min[idx] = np.minimum(self.bounds_min[idx], lo)
+            self.bounds_max[idx] = np.maximum(self.bounds_max[idx], hi)
+            self.dirty = True
+
+    #Bytes held for each tile name
+    def memory_usage(self):
+        usage = {obj.name: self.bounds_min[i].nbytes + self.bounds_max[i].nbytes + self.xforms[i].nbytes for i, obj in enumerate(self.objects)}
+        if not self.dirty:
+            usage["(shared)"] = self.world_min.nbytes + self.world_max.nbytes + self.order.nbytes + self.sorted_min_x.nbytes
+        return usage
+
+    #Clips the infinite line through location along brush_dir to the AABB of all
+    # tiles and returns the world space box that the brush cylinder can touch.
+    def __query_box(self, location, brush_dir, brush_radius):
+        origin = np.asarray(location, dtype = np.float64)
+        dir = np.asarray(brush_dir, dtype = np.float64)
+
+        t_min = -math.inf
+        t_max = math.inf
+        lo = self.scene_min - brush_radius
+        hi = self.scene_max + brush_radius
+        for k in range(3):
+            if abs(dir[k]) < 1e-12:
+                if origin[k] < lo[k] or origin[k] > hi[k]:
+                    return None
+                continue
+            t0 = (lo[k] - origin[k]) / dir[k]
+            t1 = (hi[k] - origin[k]) / dir[k]
+            t_min = max(t_min, min(t0, t1))
+            t_max = min(t_max, max(t0, t1))
+
+        if t_min > t_max:
+            return None
+
+        p0 = origin + dir * (t_min if math.isfinite(t_min) else 0)
+        p1 = origin + dir * (t_max if math.isfinite(t_max) else 0)
+        return (np.minimum(p0, p1) - brush_radius, np.maximum(p0, p1) + brush_radius)
+
+    #Returns the tiles touched by a cylinder of brush_radius around the line
+    # through location pointing along brush_dir
+    def query(self, location, brush_dir, brush_radius):
+        if len(self.objects) == 0:
+            return []
+
+        if self.dirty:
+            self.__rebuild()
+
+        box = self.__query_box(location, brush_dir, brush_radius)
+        if box is None:
+            return []
+        q_min, q_max = box
+
+        #Interval search along X using the sorted tile minimums
+        start = np.searchsorted(self.sorted_min_x, q_min[0] - self.max_extent_x, side = 'left')
+        end = np.searchsorted(self.sorted_min_x, q_max[0], side = 'right')
+        cand = self.order[start:end]
+
+        overlap = np.all((self.world_min[cand] <= q_max) & (self.world_max[cand] >= q_min), axis = 1)
+        cand = cand[overlap]
+        if len(cand) == 0:
+            return []
+
+        #Exact test against the oriented bounds
+        hits = intersect_bounds_with_ray_batch(self.bounds_min[cand], self.bounds_max[cand], self.xforms[cand], location, brush_dir, brush_radius)
+
+        return [self.objects[i] for i in np.sort(cand[hits])]
+